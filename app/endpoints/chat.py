@@ -5,14 +5,13 @@ from fastapi import APIRouter, Depends, HTTPException, Query, status, Background
 from pydantic import BaseModel, Field
 from sqlalchemy.orm import Session
 
-from database.session import get_db, SessionLocal
+from database.session import get_db
 from crud import chat as crud
 from schemas.chat import (
     ChatSessionCreate, ChatSessionUpdate, ChatSessionResponse,
     MessageCreate, MessageResponse,
     FeedbackCreate, FeedbackResponse,
 )
-from service.metrics import recompute_model_metrics
 from core.scheduler import trigger_upsert_today_now
 from langchain_service.embedding.get_vector import text_to_vector
 
@@ -84,10 +83,6 @@ def delete_session(session_id: int, db: Session = Depends(get_db)):
 class MessageCreateIn(MessageCreate):
     vector_memory: Optional[List[float]] = Field(default=None, description="1536-dim vector")
 
-def _recompute_job():
-    with SessionLocal() as db:
-        recompute_model_metrics(db)
-
 @router.post("/sessions/{session_id}/messages", response_model=MessageResponse, status_code=status.HTTP_201_CREATED)
 def create_message(
     session_id: int,
@@ -132,8 +127,7 @@ def create_message(
     )
 
     if role == "assistant":
-        # 모델 메트릭 재계산
-        background_tasks.add_task(_recompute_job)
+        # 모델 메트릭은 스케줄러(core/scheduler.job_model_metrics)가 5분마다 갱신
         # 대시보드: 어시스턴트 응답 생성 시 오늘 롤업 즉시 갱신
         background_tasks.add_task(trigger_upsert_today_now)
 
@@ -12,6 +12,7 @@ from schemas.knowledge import (
     KnowledgePageCreate, KnowledgePageResponse,   # 사용 안 하는 KnowledgePageUpdate 제거
     KnowledgeChunkResponse)
 
+from service.qa_cache import qa_cache
 from service.upload_pipeline import UploadPipeline
 
 router = APIRouter(prefix="/knowledge", tags=["Knowledge"])
@@ -63,6 +64,7 @@ def update_knowledge(knowledge_id: int, payload: KnowledgeUpdate, db: Session =
 def delete_knowledge(knowledge_id: int, db: Session = Depends(get_db)):
     if not crud.delete_knowledge(db, knowledge_id):
         raise HTTPException(status_code=404, detail="not found")
+    qa_cache.clear()
     return None
 
 
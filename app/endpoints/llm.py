@@ -4,14 +4,16 @@ from __future__ import annotations
 from typing import Any, Dict, List, Literal, Optional, Union
 
 from fastapi import APIRouter, Depends, File, Form, UploadFile
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 
 from database.session import get_db
 from schemas.llm import ChatQARequest, QAResponse, STTResponse
 from service.llm_service import (
     ask_in_session_service,
+    ask_in_session_stream_service,
     list_session_messages_service,
-    stt_service,
+    stt_service_async,
 )
 
 router = APIRouter(prefix="/llm", tags=["LLM"])
@@ -22,6 +24,16 @@ def ask_in_session(session_id: int, payload: ChatQARequest, db: Session = Depend
     return ask_in_session_service(db, session_id=session_id, payload=payload)
 
 
+@router.post("/chat/sessions/{session_id}/qa/stream", summary="LLM 입력창(스트리밍, SSE)")
+def ask_in_session_stream(session_id: int, payload: ChatQARequest, db: Session = Depends(get_db)):
+    events = ask_in_session_stream_service(db, session_id=session_id, payload=payload)
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @router.post("/stt", response_model=Union[STTResponse, QAResponse])
 async def stt(
     file: UploadFile = File(...),
@@ -39,7 +51,8 @@ async def stt(
 ):
     raw = await file.read()
     content_type = file.content_type or ""
-    return stt_service(
+    # 변환/QA는 스레드풀, 원격 STT 대기는 이벤트 루프에서 await
+    return await stt_service_async(
         db,
         raw=raw,
         content_type=content_type,
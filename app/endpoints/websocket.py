@@ -33,7 +33,7 @@ async def notifications_ws(
     try:
         while True:
             recv_task = asyncio.create_task(websocket.receive_json())
-            send_task = asyncio.create_task(conn.send_q.get())
+            send_task = asyncio.create_task(conn.data_event.wait())
 
             done, pending = await asyncio.wait(
                 {recv_task, send_task},
@@ -44,8 +44,12 @@ async def notifications_ws(
                 t.cancel()
 
             if send_task in done:
-                msg = send_task.result()
-                await websocket.send_json(msg)
+                # 쌓인 메시지를 모두 보냄: ws_manager가 publish 시점에 한 번 직렬화한 JSON 텍스트(텍스트 프레임 유지)
+                q = conn.send_q
+                while q:
+                    await websocket.send_text(q.popleft())
+                # 비어 있음을 확인한 직후 await 없이 clear → 그 사이 들어온 메시지를 놓치지 않음
+                conn.data_event.clear()
 
             if recv_task in done:
                 data = recv_task.result() or {}
@@ -58,6 +58,12 @@ UPSTAGE_API = os.getenv("UPSTAGE_API")
 
 CLOVA_STT_ID= os.getenv("CLOVA_STT_ID")
 CLOVA_STT_SECRET= os.getenv("CLOVA_STT_SECRET")
+
+# STT 결과 캐시 디렉터리(sha256(wav)+lang+provider+model → 텍스트). 기본은 끔(빈 값)
+# 켤 때는 소스 트리 밖 경로 권장. 사용자 발화 텍스트가 저장되므로 TTL/개수 상한으로 정리
+STT_CACHE_DIR = os.getenv("STT_CACHE_DIR", "")
+STT_CACHE_TTL_SECONDS = int(os.getenv("STT_CACHE_TTL_SECONDS", str(24 * 3600)))
+STT_CACHE_MAX_FILES = int(os.getenv("STT_CACHE_MAX_FILES", "5000"))
 CLOVA_STT_URL = "https://clovasr.naverncp.com/recog/v1/stt"
 
 # 인증 헤더용 Base64 토큰 생성
@@ -84,6 +90,23 @@ DB_SERVER = os.getenv("DB_SERVER", "")
 DB_PORT = os.getenv("DB_PORT", "5432")
 DB_NAME = os.getenv("DB_NAME", "")
 
+# 커넥션 풀 / 동기 엔드포인트 스레드풀 크기(sync def 라우트는 threadpool에서 실행됨)
+# 세션을 여는 스레드 = anyio 스레드풀 + QA 스트리밍 풀 + STT 비용 풀 + 스케줄러/푸시 여유분
+# → 풀 용량(DB_POOL_SIZE + DB_MAX_OVERFLOW)이 이 합보다 작으면 checkout 대기/TimeoutError
+# (워커 프로세스 1개 기준 합이 PostgreSQL 기본 max_connections=100 아래가 되도록 기본값 설정)
+THREADPOOL_SIZE = int(os.getenv("THREADPOOL_SIZE", "60"))
+QA_STREAM_WORKERS = int(os.getenv("QA_STREAM_WORKERS", "16"))
+STT_COST_WORKERS = int(os.getenv("STT_COST_WORKERS", "4"))
+DB_RESERVED_CONNECTIONS = int(os.getenv("DB_RESERVED_CONNECTIONS", "4"))
+DB_SIDE_CONNECTIONS = QA_STREAM_WORKERS + STT_COST_WORKERS + DB_RESERVED_CONNECTIONS
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "20"))
+DB_MAX_OVERFLOW = int(os.getenv(
+    "DB_MAX_OVERFLOW",
+    str(max(0, THREADPOOL_SIZE + DB_SIDE_CONNECTIONS - DB_POOL_SIZE)),
+))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "3600"))
+
 VECTOR_DB_CONNECTION = os.getenv(
     "VECTOR_DB_CONNECTION",
     f"{DB}://{DB_USER}:{DB_PASSWORD}@{DB_SERVER}:{DB_PORT}/{DB_NAME}" if all([DB_USER, DB_PASSWORD, DB_SERVER, DB_NAME]) else ""
@@ -98,11 +121,41 @@ USE_LLM_PREVIEW = _env_bool("USE_LLM_PREVIEW", False)
 
 USE_PARENT_CHILD_CHUNKING = _env_bool("USE_PARENT_CHILD_CHUNKING", True)
 
+# PDF 파싱을 돌릴 별도 프로세스 수(0이면 요청 스레드에서 직접 파싱)
+UPLOAD_PARSE_WORKERS = int(os.getenv("UPLOAD_PARSE_WORKERS", "2"))
+# 이 페이지 수 이상이면 페이지 범위를 워커별로 나눠 병렬 파싱
+UPLOAD_PARSE_SPLIT_MIN_PAGES = int(os.getenv("UPLOAD_PARSE_SPLIT_MIN_PAGES", "64"))
+# 부모-자식 청킹에서 섹션이 이 개수 이상이면 섹션 분할을 워커 프로세스에 나눠 실행
+UPLOAD_SPLIT_PARALLEL_MIN_SECTIONS = int(os.getenv("UPLOAD_SPLIT_PARALLEL_MIN_SECTIONS", "16"))
+
+# 같은 내용(해시 일치)의 active 문서가 있으면 파싱/청킹/임베딩 없이 페이지·청크를 복사
+UPLOAD_DEDUP_BY_HASH = _env_bool("UPLOAD_DEDUP_BY_HASH", True)
+
 CHILD_CHUNK_SIZE = int(os.getenv("CHILD_CHUNK_SIZE", "900"))
 CHILD_CHUNK_OVERLAP = int(os.getenv("CHILD_CHUNK_OVERLAP", "150"))
+# 이 토큰 수 미만인 자식 청크는 이웃 청크에 병합(분할 끝자락 자투리 청크 방지)
+CHILD_MIN_CHUNK_TOKENS = int(os.getenv("CHILD_MIN_CHUNK_TOKENS", str(min(100, CHILD_CHUNK_SIZE // 9))))
 
 PARENT_SUMMARY_MAX_CHARS = int(os.getenv("PARENT_SUMMARY_MAX_CHARS", "220"))
 
+# 임베딩 전 필터: 너무 짧거나(공백/쪽번호 등) 문자 비율이 낮은 청크는 임베딩하지 않음
+EMBED_MIN_CHARS = int(os.getenv("EMBED_MIN_CHARS", "20"))
+EMBED_MIN_ALPHA_RATIO = float(os.getenv("EMBED_MIN_ALPHA_RATIO", "0.3"))
+
+# 질문 임베딩 LRU 캐시(text_to_vector, 프로세스 단위). 1536-d float64 기준 2000개 ≈ 25MB
+EMBED_CACHE_MAX_ENTRIES = int(os.getenv("EMBED_CACHE_MAX_ENTRIES", "2000"))
+EMBED_CACHE_TTL_SECONDS = float(os.getenv("EMBED_CACHE_TTL_SECONDS", "3600"))
+
+# 업로드 청크 배치 임베딩(text_list_to_vectors) 1회 요청당 입력 개수
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+# 업로드 임베딩 배치 동시 요청 수(프로세스 전체 공용 풀 크기)
+EMBED_MAX_CONCURRENCY = int(os.getenv("EMBED_MAX_CONCURRENCY", "4"))
+
+# 업로드 청크 임베딩 디스크 캐시(sqlite) 경로. 빈 값이면 비활성(/cache/는 .gitignore 대상)
+EMBED_DISK_CACHE_PATH = os.getenv("EMBED_DISK_CACHE_PATH", str(BASE_DIR / "cache" / "embeddings.sqlite3"))
+# 캐시 최대 행 수(1536차원 float32 ≈ 6KB/행). 넘으면 오래 전에 쓰인 행부터 삭제
+EMBED_DISK_CACHE_MAX_ROWS = int(os.getenv("EMBED_DISK_CACHE_MAX_ROWS", "50000"))
+
 EMBED_INCLUDE_PARENT_TITLE = _env_bool("EMBED_INCLUDE_PARENT_TITLE", True)
 EMBED_INCLUDE_ALIASES = _env_bool("EMBED_INCLUDE_ALIASES", True)
 
@@ -118,6 +171,13 @@ VECTOR_CANDIDATE_MULT = 5
 IVFFLAT_PROBES = 10   # lists=100이면 보통 5~20 사이에서 튜닝
 RAG_MIN_SCORE = float(os.getenv("RAG_MIN_SCORE", "0.12"))
 
+# QA 시맨틱 캐시: 같은 조건(knowledge/top_k/style/profile/flags)에서 유사 질문이면 이전 응답 재사용
+# 문서 업로드(복제 포함)/삭제 시 전체 무효화. 청크 직접 수정/페이지 변경은 무효화하지 않으므로 최대 TTL 동안 이전 답변이 나갈 수 있음
+QA_CACHE_ENABLED = _env_bool("QA_CACHE_ENABLED", True)
+QA_CACHE_MAX_ENTRIES = int(os.getenv("QA_CACHE_MAX_ENTRIES", "1000"))
+QA_CACHE_TTL_SECONDS = float(os.getenv("QA_CACHE_TTL_SECONDS", "300"))
+QA_CACHE_SIM_THRESHOLD = float(os.getenv("QA_CACHE_SIM_THRESHOLD", "0.92"))
+
 
 # 8) 모델 카탈로그
 OPENAI_MODELS = os.getenv("OPENAI_MODELS", "gpt-4-mini,gpt-4o,gpt-4-turbo")
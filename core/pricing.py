@@ -2,6 +2,7 @@ from __future__ import annotations
 from dataclasses import dataclass
 from datetime import datetime
 from decimal import Decimal, ROUND_HALF_UP
+from functools import lru_cache
 from math import ceil
 from typing import List, Optional, Iterable
 
@@ -35,6 +36,12 @@ def _require_price(product: str, model: str, key: str) -> Decimal:
 
 
 # ===== tiktoken 토큰 계산 유틸 =====
+# 비용/길이 계산용이므로 encode_ordinary 사용: 특수 토큰 검사 없음(더 빠르고, 본문에 '<|endoftext|>'가 있어도 예외 없음)
+# 이 개수 이상이면 encode_ordinary_batch(내부 스레드 병렬)로 한 번에 토큰화
+_ENCODE_BATCH_MIN = 32
+
+
+@lru_cache(maxsize=None)
 def _get_encoder_for_model(model: str):
     if not _HAS_TIKTOKEN:
         log.debug("tiktoken not installed. falling back to char-count for model=%s", model)
@@ -56,7 +63,7 @@ def tokens_for_text(model: str, text: str) -> int:
     enc = _get_encoder_for_model(model)
     if enc is None:
         return len(text)
-    return len(enc.encode(text))
+    return len(enc.encode_ordinary(text))
 
 
 def tokens_for_texts(model: str, texts: Iterable[str]) -> int:
@@ -64,10 +71,10 @@ def tokens_for_texts(model: str, texts: Iterable[str]) -> int:
     enc = _get_encoder_for_model(model)
     if enc is None:
         return sum(len(t or "") for t in texts)
-    total = 0
-    for t in texts:
-        total += len(enc.encode(t or ""))
-    return total
+    texts = [t or "" for t in texts]
+    if len(texts) >= _ENCODE_BATCH_MIN:
+        return sum(map(len, enc.encode_ordinary_batch(texts)))
+    return sum(len(enc.encode_ordinary(t)) for t in texts)
 
 
 # ===== 임베딩 =====
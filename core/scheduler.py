@@ -7,9 +7,11 @@ import logging
 
 from database.session import SessionLocal
 from crud import daily_dashboard as crud
+from service.metrics import try_recompute_model_metrics
 
 ### 전일: 매일 00:05 KST 자동 집계.
 ### 당일: 매시간 05분 갱신.
+### 모델 운영 지표(model 싱글톤): 5분마다 갱신.
 
 TZ = ZoneInfo("Asia/Seoul")
 log = logging.getLogger("scheduler")
@@ -40,6 +42,17 @@ def job_today_hourly():
     # 매시간 05분 KST → 당일 갱신(준실시간)
     _run_upsert_for(_kst_today())
 
+def job_model_metrics():
+    # 5분마다 → model 싱글톤 지표 갱신(요청 경로에서는 집계하지 않음)
+    db: Session = SessionLocal()
+    try:
+        if try_recompute_model_metrics(db):
+            log.info("model metrics recomputed")
+    except Exception:
+        log.exception("model metrics recompute failed")
+    finally:
+        db.close()
+
 def init_scheduler(start_immediately: bool = True) -> AsyncIOScheduler:
     global _SCHED
     sched = AsyncIOScheduler(
@@ -52,6 +65,9 @@ def init_scheduler(start_immediately: bool = True) -> AsyncIOScheduler:
     # 당일 갱신: 매시간 05분
     sched.add_job(job_today_hourly, trigger="cron", minute=5,
                   id="daily_dashboard_today_hourly", replace_existing=True, misfire_grace_time=300)
+    # 모델 지표: 5분 간격
+    sched.add_job(job_model_metrics, trigger="interval", minutes=5,
+                  id="model_metrics", replace_existing=True, misfire_grace_time=120)
 
     if start_immediately:
         # 부팅 직후 보정: 전일/당일 한 번씩 빠르게 실행
@@ -7,9 +7,9 @@ from zoneinfo import ZoneInfo
 _KST = ZoneInfo("Asia/Seoul")
 from typing import Any, Dict, List, Literal, Optional
 
-from fastapi.encoders import jsonable_encoder
-from sqlalchemy import func, select
+from sqlalchemy import bindparam, func, select, text, update
 from sqlalchemy.orm import Session
+from sqlalchemy.types import JSON
 
 from models.chat import ChatSession, Message, Feedback
 
@@ -28,17 +28,15 @@ def _kst_now() -> datetime:
 
 def _safe_json(v: Any) -> Any:
     """
-    JSON/JSONB 컬럼에 안전하게 들어가도록 변환.
-    - pydantic/ORM/datetime/numpy 등이 섞여도 저장 가능하도록 처리
+    JSON/JSONB 컬럼 입력 정리.
+    - 실제 직렬화(pydantic/datetime/numpy/Decimal 포함)는 엔진의 json_serializer(orjson)가 담당
+    - 여기서는 "null" 문자열만 None으로 정리(중간 jsonable_encoder 변환 없음)
     """
     if v is None:
         return None
     if isinstance(v, str) and v.lower() == "null":
         return None
-    try:
-        return jsonable_encoder(v)
-    except Exception:
-        return str(v)
+    return v
 
 
 def _validate_vector(vec: Optional[List[float]]) -> Optional[List[float]]:
@@ -200,6 +198,55 @@ def create_message(
         raise
 
 
+# assistant message INSERT + (실패 시) session_insight 실패 표시를 한 문장으로 처리
+_INSERT_ASSISTANT_MARK_FAILED_SQL = text(
+    """
+    WITH m AS (
+        INSERT INTO message (session_id, role, content, response_latency_ms, extra_data)
+        VALUES (:session_id, 'assistant', :content, :response_latency_ms, :extra_data)
+        RETURNING id
+    ), u AS (
+        UPDATE chat_session_insight
+        SET status = 'failed', failed_reason = :failed_reason, updated_at = now()
+        WHERE session_id = :session_id AND :failed
+        RETURNING session_id
+    )
+    SELECT id FROM m
+    """
+).bindparams(bindparam("extra_data", type_=JSON))
+
+
+def create_message_and_maybe_mark_failed(
+    db: Session,
+    *,
+    session_id: int,
+    content: str,
+    response_latency_ms: Optional[int] = None,
+    extra_data: Optional[Any] = None,
+    failed: bool = False,
+    failed_reason: Optional[str] = None,
+) -> int:
+    """
+    assistant 메시지 저장 + failed면 chat_session_insight.status='failed' 를 CTE 한 번으로 처리.
+    - ORM create_message + ensure_session_insight(SELECT) + flush 왕복을 1회로 줄임
+    - session_insight row는 user 메시지 기록 시점(ensure_session_insight)에 이미 있어야 함
+    - commit은 호출부 책임
+    반환: 생성된 message id
+    """
+    message_id = db.execute(
+        _INSERT_ASSISTANT_MARK_FAILED_SQL,
+        {
+            "session_id": int(session_id),
+            "content": content,
+            "response_latency_ms": response_latency_ms,
+            "extra_data": _safe_json(extra_data),
+            "failed": bool(failed),
+            "failed_reason": failed_reason,
+        },
+    ).scalar_one()
+    return int(message_id)
+
+
 def create_user_message(
     db: Session,
     session_id: int,
@@ -280,6 +327,33 @@ def last_by_role(db: Session, session_id: int, role: Role) -> Optional[Message]:
     return db.scalars(stmt).first()
 
 
+def set_last_user_vector(
+    db: Session,
+    session_id: int,
+    vector: List[float],
+    commit: bool = True,
+) -> None:
+    """
+    마지막 user 메시지의 vector_memory를 UPDATE 한 문장으로 갱신
+    (last_by_role SELECT → ORM UPDATE → refresh 왕복 제거)
+    """
+    last_id = (
+        select(Message.id)
+        .where(Message.session_id == session_id, Message.role == "user")
+        .order_by(Message.created_at.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+    db.execute(
+        update(Message)
+        .where(Message.id == last_id)
+        .values(vector_memory=_validate_vector(vector))
+        .execution_options(synchronize_session=False)
+    )
+    if commit:
+        db.commit()
+
+
 # =========================================================
 # Feedback
 # =========================================================
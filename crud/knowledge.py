@@ -3,11 +3,12 @@ from __future__ import annotations
 
 import logging
 import os
-from typing import Optional, List, Dict, Any, Literal, Sequence, Tuple
+from typing import Optional, List, Dict, Any, Iterable, Literal, Sequence, Tuple
 
-from sqlalchemy import select, func, or_
+from sqlalchemy import insert, select, func, or_
 from sqlalchemy import text as sql_text
 from sqlalchemy.orm import Session
+from psycopg2.extras import execute_values
 
 from models.knowledge import Knowledge, KnowledgePage, KnowledgeChunk
 
@@ -20,6 +21,19 @@ log = logging.getLogger("knowledge")
 # - 환경변수로 조절 가능: IVFFLAT_PROBES=10
 _IVFFLAT_PROBES = int(os.getenv("IVFFLAT_PROBES", "10"))
 
+# upload 청크 일괄 저장(execute_values) 설정
+_CHUNK_INSERT_PAGE_SIZE = 500
+_CHUNK_INSERT_SQL = """
+    INSERT INTO knowledge_chunk (knowledge_id, page_id, chunk_index, chunk_text, vector_memory)
+    VALUES %s
+    ON CONFLICT (knowledge_id, chunk_index) DO UPDATE SET
+        page_id       = EXCLUDED.page_id,
+        chunk_text    = EXCLUDED.chunk_text,
+        vector_memory = EXCLUDED.vector_memory
+"""
+_CHUNK_INSERT_TEMPLATE = "(%s, %s, %s, %s, %s::vector)"
+_PAGE_INSERT_SQL = "INSERT INTO knowledge_page (knowledge_id, page_no, image_url) VALUES %s"
+
 
 # =========================================================
 # Internal helpers
@@ -170,6 +184,49 @@ def list_knowledge(
     return db.execute(stmt).scalars().all()
 
 
+def find_knowledge_by_hash(db: Session, content_hash: str) -> Optional[Knowledge]:
+    """같은 원본 해시를 가진 가장 최근 active 문서"""
+    stmt = (
+        select(Knowledge)
+        .where(Knowledge.content_hash == content_hash, Knowledge.status == "active")
+        .order_by(Knowledge.id.desc())
+        .limit(1)
+    )
+    return db.execute(stmt).scalars().first()
+
+
+_CLONE_PAGES_SQL = sql_text(
+    """
+    INSERT INTO knowledge_page (knowledge_id, page_no, image_url)
+    SELECT :dst, page_no, image_url
+    FROM knowledge_page
+    WHERE knowledge_id = :src
+    """
+)
+_CLONE_CHUNKS_SQL = sql_text(
+    """
+    INSERT INTO knowledge_chunk (knowledge_id, page_id, chunk_index, chunk_text, vector_memory)
+    SELECT :dst, np.id, c.chunk_index, c.chunk_text, c.vector_memory
+    FROM knowledge_chunk c
+    LEFT JOIN knowledge_page op ON op.id = c.page_id
+    LEFT JOIN knowledge_page np ON np.knowledge_id = :dst AND np.page_no = op.page_no
+    WHERE c.knowledge_id = :src
+    """
+)
+
+
+def clone_knowledge_content(db: Session, src_id: int, dst_id: int, commit: bool = True) -> int:
+    """
+    src 문서의 페이지/청크(벡터 포함)를 dst 문서로 DB 안에서 복사(INSERT ... SELECT, 벡터 왕복 없음)
+    반환: 복사한 청크 수
+    """
+    params = {"src": int(src_id), "dst": int(dst_id)}
+    db.execute(_CLONE_PAGES_SQL, params)
+    n = db.execute(_CLONE_CHUNKS_SQL, params).rowcount
+    _finalize(db, commit=commit)
+    return int(n or 0)
+
+
 def create_knowledge(db: Session, data: dict, commit: bool = True) -> Knowledge:
     obj = Knowledge(**data)
     db.add(obj)
@@ -254,18 +311,44 @@ def upsert_page(
     return obj
 
 
-def bulk_create_pages(db: Session, knowledge_id: int, pages: list[dict], commit: bool = True) -> int:
-    objs = [
-        KnowledgePage(
-            knowledge_id=knowledge_id,
-            page_no=int(p["page_no"]),
-            image_url=(p.get("image_url") or ""),
-        )
+def bulk_create_pages(db: Session, knowledge_id: int, pages: Iterable[dict], commit: bool = True) -> int:
+    """
+    ORM 객체를 만들지 않고 insert(...) executemany 한 번으로 저장(id/created_at은 DB 기본값).
+    """
+    rows = [
+        {"knowledge_id": knowledge_id, "page_no": int(p["page_no"]), "image_url": (p.get("image_url") or "")}
         for p in pages
     ]
-    db.add_all(objs)
+    if rows:
+        db.execute(insert(KnowledgePage), rows)
     _finalize(db, commit=commit)
-    return len(objs)
+    return len(rows)
+
+
+def create_knowledge_pages(
+    db: Session,
+    knowledge_id: int,
+    num_pages: int,
+    image_urls: Optional[Sequence[str]] = None,
+    commit: bool = True,
+) -> int:
+    """
+    upload_pipeline용 페이지 일괄 저장(page_no 1..num_pages)
+    - 행마다 dict를 만들지 않고 튜플로 execute_values 전송(create_knowledge_chunks와 같은 경로)
+    반환: 저장한 row 수
+    """
+    if num_pages <= 0:
+        return 0
+    urls = image_urls or ()
+    n_urls = len(urls)
+    kid = int(knowledge_id)
+    rows = [(kid, i, (urls[i - 1] or "") if i <= n_urls else "") for i in range(1, num_pages + 1)]
+
+    dbapi_conn = db.connection().connection
+    with dbapi_conn.cursor() as cur:
+        execute_values(cur, _PAGE_INSERT_SQL, rows, page_size=_CHUNK_INSERT_PAGE_SIZE)
+    _finalize(db, commit=commit)
+    return len(rows)
 
 
 def delete_page(db: Session, page_id: int, commit: bool = True) -> bool:
@@ -423,32 +506,54 @@ def bulk_upsert_chunks(
     return out
 
 
+_FLOAT32_FMT = "{:.9g}".format
+
+
+def _vector_literal(vec: VectorArray) -> str:
+    """
+    pgvector 텍스트 표현('[x,y,...]')으로 변환.
+    vector 컬럼은 float4로 저장하므로 float32 왕복에 충분한 유효숫자 9자리만 전송(float64 repr 대비 약 35% 짧음)
+    ndarray는 tolist()로 한 번에 파이썬 float로 변환(원소별 numpy 스칼라 포맷보다 빠름)
+    """
+    if hasattr(vec, "tolist"):
+        vec = vec.tolist()
+    return "[" + ",".join(map(_FLOAT32_FMT, vec)) + "]"
+
+
 def create_knowledge_chunks(
     db: Session,
     knowledge_id: int,
     chunks: list[str],
-    vectors: list[list[float]],
+    vectors: Sequence[VectorArray],
     commit: bool = True,
-) -> List[KnowledgeChunk]:
+) -> int:
     """
     upload_pipeline용 배치 저장 (chunk_index는 1부터)
+    - ORM 객체를 만들지 않고 execute_values 단일 INSERT로 전송(청크 수만큼 왕복하지 않음)
+    - (knowledge_id, chunk_index) 충돌 시 덮어쓰기(bulk_upsert_chunks와 동일한 의미)
+    반환: 저장한 row 수
     """
-    items: List[Dict[str, Any]] = []
+    rows: List[Tuple[int, Optional[int], int, str, str]] = []
     for i, (text, vec) in enumerate(zip(chunks, vectors), start=1):
         t = (text or "").strip()
         if not t or vec is None:
             continue
-        items.append(
-            {
-                "page_id": None,
-                "chunk_index": i,  # 1부터
-                "chunk_text": t,
-                "vector_memory": [float(x) for x in vec],
-            }
+        rows.append((int(knowledge_id), None, i, t, _vector_literal(vec)))  # chunk_index 1부터
+    if not rows:
+        return 0
+
+    # 세션 트랜잭션에 묶인 DBAPI(psycopg2) 커넥션을 그대로 사용 → commit/rollback은 세션이 관리
+    dbapi_conn = db.connection().connection
+    with dbapi_conn.cursor() as cur:
+        execute_values(
+            cur,
+            _CHUNK_INSERT_SQL,
+            rows,
+            template=_CHUNK_INSERT_TEMPLATE,
+            page_size=_CHUNK_INSERT_PAGE_SIZE,
         )
-    if not items:
-        return []
-    return bulk_upsert_chunks(db, knowledge_id, items, commit=commit, refresh=False)
+    _finalize(db, commit=commit)
+    return len(rows)
 
 
 # upload_pipeline이 기존 이름(create_chunks)으로 호출해도 안 깨지게 alias 제공
@@ -458,7 +563,7 @@ def create_chunks(
     chunks: list[str],
     vectors: list[list[float]],
     commit: bool = True,
-) -> List[KnowledgeChunk]:
+) -> int:
     return create_knowledge_chunks(db, knowledge_id, chunks, vectors, commit=commit)
 
 
@@ -0,0 +1,34 @@
+"""knowledge.content_hash for duplicate upload detection
+
+Revision ID: 20261016_kdoc_content_hash
+Revises: 20261016_msg_assistant_idx
+Create Date: 2026-10-16
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+
+revision: str = '20261016_kdoc_content_hash'
+down_revision: Union[str, Sequence[str], None] = '20261016_msg_assistant_idx'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # 기존 문서는 해시 없음(null) → 재업로드 시 중복 감지 대상 아님
+    op.add_column("knowledge", sa.Column("content_hash", sa.Text(), nullable=True))
+    # 같은 파일을 의도적으로 다시 올릴 수 있으므로 unique가 아닌 부분 인덱스
+    with op.get_context().autocommit_block():
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_kdoc_content_hash "
+            "ON knowledge (content_hash) WHERE content_hash IS NOT NULL"
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS idx_kdoc_content_hash")
+    op.drop_column("knowledge", "content_hash")
@@ -0,0 +1,30 @@
+"""partial index for monthly assistant-message metrics
+
+Revision ID: 20261016_msg_assistant_idx
+Revises: 20260604_inq_owner_store
+Create Date: 2026-10-16
+
+"""
+from typing import Sequence, Union
+from alembic import op
+
+
+revision: str = '20261016_msg_assistant_idx'
+down_revision: Union[str, Sequence[str], None] = '20260604_inq_owner_store'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # chat_session / feedback의 created_at 인덱스는 이미 존재(idx_chat_session_started_at, idx_feedback_created)
+    # CONCURRENTLY는 트랜잭션 밖에서만 가능
+    with op.get_context().autocommit_block():
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_message_assistant_created "
+            "ON message (created_at) WHERE role = 'assistant'"
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS idx_message_assistant_created")
@@ -1,9 +1,42 @@
+from decimal import Decimal
+
+import orjson
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 import database.base as base
 import psycopg2
 
-engine = create_engine(base.DATABASE_URL, echo=True)
+
+def _json_default(o):
+    """orjson이 기본 지원하지 않는 타입(Decimal/pydantic 등) 처리"""
+    if isinstance(o, Decimal):
+        return float(o)
+    if hasattr(o, "model_dump"):
+        return o.model_dump(mode="json")
+    if isinstance(o, (set, frozenset)):
+        return list(o)
+    return str(o)
+
+
+def _json_serializer(obj) -> str:
+    # JSON/JSONB 컬럼 직렬화: stdlib json 대신 orjson
+    return orjson.dumps(
+        obj,
+        default=_json_default,
+        option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY,
+    ).decode()
+
+
+engine = create_engine(
+    base.DATABASE_URL,
+    echo=True,
+    pool_size=base.config.DB_POOL_SIZE,
+    max_overflow=base.config.DB_MAX_OVERFLOW,
+    pool_pre_ping=True,
+    pool_recycle=base.config.DB_POOL_RECYCLE,
+    json_serializer=_json_serializer,
+    json_deserializer=orjson.loads,
+)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 def get_db():
@@ -1,22 +1,117 @@
 # langchain_service/embedding/get_vector
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Executor
+
 import requests
 import numpy as np
-from typing import List
+from typing import List, Optional
 from langchain_core.embeddings import Embeddings
+from core import config
 from langchain_service.embedding.setup import get_embeddings
+from service import embedding_ctx
+
+log = logging.getLogger(__name__)
+
+# 프로세스 단위 임베딩 LRU(+TTL): 반복 질문/재시도/시맨틱 캐시 조회가 임베딩 API를 다시 타지 않게 함
+_EMBED_CACHE: "OrderedDict[str, tuple[float, np.ndarray]]" = OrderedDict()
+_EMBED_CACHE_LOCK = threading.RLock()
+
+
+def _embed_cache_key(text) -> str:
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()
+
+
+def _embed_cache_get(key: str):
+    with _EMBED_CACHE_LOCK:
+        hit = _EMBED_CACHE.get(key)
+        if hit is None:
+            return None
+        ts, vector = hit
+        if time.monotonic() - ts >= config.EMBED_CACHE_TTL_SECONDS:
+            del _EMBED_CACHE[key]
+            return None
+        _EMBED_CACHE.move_to_end(key)
+        return vector
+
+
+def _embed_cache_put(key: str, vector: np.ndarray) -> None:
+    with _EMBED_CACHE_LOCK:
+        _EMBED_CACHE[key] = (time.monotonic(), vector)
+        _EMBED_CACHE.move_to_end(key)
+        while len(_EMBED_CACHE) > config.EMBED_CACHE_MAX_ENTRIES:
+            _EMBED_CACHE.popitem(last=False)
 
 
 def text_to_vector(text):
+    # 요청 메모/프로세스 LRU 모두 같은 키 사용(텍스트 해시 1회)
+    key = _embed_cache_key(text)
+    # 같은 요청 안에서 이미 임베딩한 텍스트면 재사용(request_embedding_scope 안에서만 동작, LRU 만료/밀림과 무관)
+    cached = embedding_ctx.lookup(key)
+    if cached is not None:
+        return cached
+
+    cached = _embed_cache_get(key)
+    if cached is not None:
+        embedding_ctx.store(key, cached)
+        return cached
+
     embeddings = get_embeddings()
     try:
         vector = embeddings.embed_query(text)
         vector = np.array(vector)
+        vector.setflags(write=False)  # 캐시 공유 객체라 읽기 전용
+        _embed_cache_put(key, vector)
+        embedding_ctx.store(key, vector)
         return vector
     except Exception as e:
         print(f"Error during embedding: {e}")
         return None
 
 
+def _embed_batch(embeddings, batch: List[str]) -> list:
+    try:
+        out = embeddings.embed_documents(batch)
+        if len(out) != len(batch):
+            raise RuntimeError(f"embedding count mismatch: {len(out)} != {len(batch)}")
+        return list(np.asarray(out, dtype=np.float32))
+    except Exception as e:
+        log.warning("batch embedding failed, falling back to single: %s", e)
+    # 단건 재시도도 질문 캐시(_EMBED_CACHE/embedding_ctx)를 거치지 않고 API를 직접 호출
+    vectors: list = []
+    for t in batch:
+        try:
+            vectors.append(np.asarray(embeddings.embed_documents([t])[0], dtype=np.float32))
+        except Exception:
+            log.exception("single embedding failed")
+            vectors.append(None)
+    return vectors
+
+
+def text_list_to_vectors(texts: List[str], executor: Optional[Executor] = None) -> list:
+    """
+    청크 목록 배치 임베딩: EMBED_BATCH_SIZE개씩 embed_documents 한 번으로 요청(배치 분할은 여기서만).
+    executor를 주면 배치들을 그 풀에서 동시에 요청(동시 요청 수는 풀 크기로 제한).
+    반환 길이/순서는 입력과 동일(store_chunks 인덱스 정렬 유지). 배치 실패 시 해당 배치만 단건으로 재시도.
+    각 벡터는 float32 ndarray(pgvector 저장 정밀도와 동일, 파이썬 float 리스트 대비 메모리 약 1/7).
+    질문 캐시(_EMBED_CACHE)는 업로드 청크로 채우지 않음.
+    """
+    embeddings = get_embeddings()
+    size = max(1, config.EMBED_BATCH_SIZE)
+    batches = [texts[i:i + size] for i in range(0, len(texts), size)]
+    if executor is None or len(batches) < 2:
+        results = (_embed_batch(embeddings, b) for b in batches)
+    else:
+        results = executor.map(lambda b: _embed_batch(embeddings, b), batches)
+    vectors: list = []
+    for out in results:
+        vectors.extend(out)
+    return vectors
+
+
 def _to_vector(question: str) -> list[float]:
     """임베딩 생성 + 변환 + 검증 래퍼 (APP/llm 및 runner에서 공통 사용)"""
     vector = text_to_vector(question)
@@ -6,7 +6,7 @@ import re
 import logging
 from datetime import datetime, timezone
 from decimal import Decimal
-from typing import Iterable, Optional, Tuple, List, Any
+from typing import Callable, Iterable, Optional, Tuple, List, Any
 
 from fastapi import HTTPException, status
 from sqlalchemy.orm import Session
@@ -43,13 +43,7 @@ CHILD_PREFIX = "[CHILD]"
 
 
 def _update_last_user_vector(db: Session, session_id: int, vector: Iterable[float]) -> None:
-    message = crud_chat.last_by_role(db, session_id, "user")
-    if not message:
-        return
-    message.vector_memory = list(vector)
-    db.add(message)
-    db.commit()
-    db.refresh(message)
+    crud_chat.set_last_user_vector(db, session_id, list(vector))
 
 
 def _retrieve_sources_and_context(
@@ -106,6 +100,18 @@ def _retrieve_sources_and_context(
     return sources, context_text, meta
 
 
+def _consume_stream(pieces: Iterable[Any], on_token: Optional[Callable[[str], None]]) -> str:
+    parts: list[str] = []
+    for piece in pieces:
+        piece = str(piece or "")
+        if not piece:
+            continue
+        parts.append(piece)
+        if on_token is not None:
+            on_token(piece)
+    return "".join(parts)
+
+
 def _render_prompt_for_estimate(
     *,
     question: str,
@@ -137,7 +143,11 @@ def _run_qa(
     force_json_output: bool = False,         # DEPRECATED: ignored
     few_shot_profile: str = "support_md",    # DEPRECATED: ignored
     streaming: bool = False,
+    on_token: Optional[Callable[[str], None]] = None,
 ) -> QAResponse:
+    """
+    on_token: streaming=True일 때 생성 조각(str)마다 호출(SSE 등 중계용).
+    """
     if style is None:
         m = crud_model.get_single(db)
         if not m:
@@ -150,12 +160,7 @@ def _run_qa(
     vector = _to_vector(question)
 
     if session_id is not None:
-        message = crud_chat.last_by_role(db, session_id, "user")
-        if message:
-            message.vector_memory = list(vector)
-            db.add(message)
-            db.commit()
-            db.refresh(message)
+        _update_last_user_vector(db, session_id, vector)
 
     # 검색 1회
     sources, context_text, meta = _retrieve_sources_and_context(
@@ -210,11 +215,12 @@ def _run_qa(
                 )
 
                 if streaming:
-                    resp_text = "".join(
+                    resp_text = _consume_stream(
                         chain.stream(
                             {"question": question, "context": context_text},
                             config={"callbacks": [cb]},
-                        )
+                        ),
+                        on_token,
                     )
                 else:
                     raw = chain.invoke(
@@ -266,7 +272,10 @@ def _run_qa(
             )
 
             if streaming:
-                resp_text = "".join(chain.stream({"question": question, "context": context_text}))
+                resp_text = _consume_stream(
+                    chain.stream({"question": question, "context": context_text}),
+                    on_token,
+                )
             else:
                 raw = chain.invoke({"question": question, "context": context_text})
                 resp_text = str(raw or "")
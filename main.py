@@ -1,14 +1,23 @@
-import os, logging, uvicorn
+import os, asyncio, logging, uvicorn
 from contextlib import asynccontextmanager
+from anyio import to_thread
 from dotenv import load_dotenv
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from fastapi.staticfiles import StaticFiles
 
 from app.routers import register_routers
-from core.config import UPLOAD_FOLDER
+from core.config import (
+    UPLOAD_FOLDER,
+    THREADPOOL_SIZE,
+    DB_POOL_SIZE,
+    DB_MAX_OVERFLOW,
+    DB_SIDE_CONNECTIONS,
+)
 from core.scheduler import init_scheduler  # APScheduler 초기화
 from core.firebase import init_firebase
+from service.ws_manager import ws_manager as notification_ws_manager
 
 load_dotenv()
 log = logging.getLogger("uvicorn")
@@ -16,6 +25,18 @@ log = logging.getLogger("uvicorn")
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # startup
+    # sync def 라우트(QA/STT/업로드)는 anyio 스레드풀에서 돎 → 기본 40개 제한 조정
+    # 단, DB 풀이 감당 못 하는 스레드 수는 풀 checkout 대기만 늘리므로 풀 용량(사이드 풀 몫 제외)으로 상한
+    db_threads = max(1, DB_POOL_SIZE + DB_MAX_OVERFLOW - DB_SIDE_CONNECTIONS)
+    threads = min(THREADPOOL_SIZE, db_threads)
+    if threads < THREADPOOL_SIZE:
+        log.warning(
+            "THREADPOOL_SIZE=%d capped to %d by DB pool capacity (pool=%d overflow=%d side=%d)",
+            THREADPOOL_SIZE, threads, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_SIDE_CONNECTIONS,
+        )
+    to_thread.current_default_thread_limiter().total_tokens = threads
+    # 알림 WS publish_sync가 첫 WS 연결 전에도 이벤트 루프를 알도록 기동 시 등록
+    notification_ws_manager.set_loop(asyncio.get_running_loop())
     init_firebase()  # 실패해도 서버는 기동 (푸시만 비활성)
     sched = init_scheduler()
     sched.start()
@@ -28,7 +49,8 @@ async def lifespan(app: FastAPI):
         sched.shutdown(wait=False)
         log.info("APScheduler stopped")
 
-app = FastAPI(debug=True, lifespan=lifespan)
+# 응답 JSON 인코딩은 orjson (JSON 컬럼 직렬화와 동일)
+app = FastAPI(debug=True, lifespan=lifespan, default_response_class=ORJSONResponse)
 
 from typing import List
 from fastapi import WebSocket
@@ -67,7 +67,15 @@ class Message(Base):
         ),
         Index("idx_message_session_created", "session_id", "created_at"),
         Index("idx_message_role_created", "role", "created_at"),
+        # 월간 지표(service/metrics.py) 집계용
+        Index(
+            "idx_message_assistant_created",
+            "created_at",
+            postgresql_where=text("role = 'assistant'"),
+        ),
     )
+    # INSERT ... RETURNING으로 id/created_at을 함께 받아 flush 후 refresh SELECT 생략
+    __mapper_args__ = {"eager_defaults": True}
 
 
 class Feedback(Base):
@@ -36,6 +36,9 @@ class Knowledge(Base):
 
     status = Column(Text, nullable=False)  # 'active' | 'processing' | 'error'
 
+    # 업로드 원본 바이트의 blake2b 해시(중복 업로드 감지용, 기존 행은 null)
+    content_hash = Column(Text, nullable=True)
+
     preview = Column(Text, nullable=False)
     preview_norm = Column(
         Text,
@@ -49,6 +52,11 @@ class Knowledge(Base):
         CheckConstraint("size >= 0", name="chk_kdoc_size_nonneg"),
         CheckConstraint("status IN ('active','processing','error')", name="chk_kdoc_status"),
         Index("idx_kdoc_created_at", created_at.desc()),
+        Index(
+            "idx_kdoc_content_hash",
+            "content_hash",
+            postgresql_where=text("content_hash IS NOT NULL"),
+        ),
 
         Index(
             "idx_kdoc_original_name_trgm",
@@ -0,0 +1,110 @@
+# service/embedding_cache.py
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+from core import config
+
+log = logging.getLogger(__name__)
+
+# 업로드 청크 임베딩 디스크 캐시(sqlite): 재업로드/문서 간 중복 문구(머리말·꼬리말 등)는 API를 다시 타지 않음
+# - 키: blake2b(model + "\0" + text), 값: float32 bytes
+# - 여러 워커 프로세스가 같은 파일을 써도 되도록 WAL 모드
+# - 읽기/쓰기 실패는 무시하고 캐시 없이 진행
+# - EMBED_DISK_CACHE_MAX_ROWS 초과분은 rowid가 작은(먼저 쓰인) 행부터 삭제(INSERT OR REPLACE는 새 rowid를 받음)
+_LOCK = threading.Lock()
+_CONN: Optional[sqlite3.Connection] = None
+_CONN_PID: Optional[int] = None
+
+
+def _key(model: str, text: str) -> str:
+    return hashlib.blake2b(f"{model}\0{text}".encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _conn() -> Optional[sqlite3.Connection]:
+    global _CONN, _CONN_PID
+    path = config.EMBED_DISK_CACHE_PATH
+    if not path:
+        return None
+    # fork된 프로세스(파싱 풀 등)에서는 부모 커넥션을 쓰지 않고 새로 연다
+    if _CONN is None or _CONN_PID != os.getpid():
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS embedding (key TEXT PRIMARY KEY, vec BLOB NOT NULL)")
+        _CONN, _CONN_PID = conn, os.getpid()
+    return _CONN
+
+
+def get_many(model: str, texts: Sequence[str]) -> Dict[int, np.ndarray]:
+    """texts 중 캐시에 있는 것만 {인덱스: float32 벡터(읽기 전용)}로 반환"""
+    if not texts:
+        return {}
+    keys = [_key(model, t) for t in texts]
+    try:
+        with _LOCK:
+            conn = _conn()
+            if conn is None:
+                return {}
+            found: Dict[str, bytes] = {}
+            uniq = list(dict.fromkeys(keys))
+            # sqlite 바인딩 변수 상한(기본 999) 아래로 나눠 조회
+            for i in range(0, len(uniq), 500):
+                part = uniq[i:i + 500]
+                rows = conn.execute(
+                    f"SELECT key, vec FROM embedding WHERE key IN ({','.join('?' * len(part))})",
+                    part,
+                ).fetchall()
+                found.update(rows)
+    except Exception as e:
+        log.warning("embedding cache read failed: %s", e)
+        return {}
+    return {
+        i: np.frombuffer(found[k], dtype=np.float32)
+        for i, k in enumerate(keys)
+        if k in found
+    }
+
+
+def _evict(conn: sqlite3.Connection) -> None:
+    cap = config.EMBED_DISK_CACHE_MAX_ROWS
+    if cap <= 0:
+        return
+    # rowid 인덱스만 보는 범위 삭제(COUNT(*) 스캔 없음). 중간 삭제로 생긴 빈 rowid만큼 보수적으로 남음
+    conn.execute(
+        "DELETE FROM embedding WHERE rowid <= (SELECT MAX(rowid) FROM embedding) - ?",
+        (cap,),
+    )
+
+
+def put_many(model: str, items: Sequence[Tuple[str, Sequence[float]]]) -> None:
+    rows = [
+        (_key(model, text), np.asarray(vec, dtype=np.float32).tobytes())
+        for text, vec in items
+        if vec is not None and len(vec)
+    ]
+    if not rows:
+        return
+    try:
+        with _LOCK:
+            conn = _conn()
+            if conn is None:
+                return
+            conn.execute("BEGIN")
+            try:
+                conn.executemany("INSERT OR REPLACE INTO embedding (key, vec) VALUES (?, ?)", rows)
+                _evict(conn)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+    except Exception as e:
+        log.warning("embedding cache write failed: %s", e)
@@ -0,0 +1,39 @@
+# service/embedding_ctx.py
+from __future__ import annotations
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, Optional
+
+# 요청 단위 임베딩 메모: 같은 요청 안에서 동일 텍스트(질문)를 여러 번 임베딩하지 않게 함
+# - 카테고리 분류(임베딩 모드) / _run_qa 검색 등이 같은 text_to_vector를 거치므로 투명하게 재사용
+# - scope 밖(배치/업로드 등)에서는 아무 것도 캐시하지 않음
+# - 키는 호출측(get_vector._embed_cache_key)이 계산해 넘김 → 프로세스 LRU와 같은 키로 텍스트 해시는 1회
+_REQUEST_VECTORS: ContextVar[Optional[Dict[str, Any]]] = ContextVar("request_vectors", default=None)
+
+
+@contextmanager
+def request_embedding_scope() -> Iterator[None]:
+    """
+    with request_embedding_scope(): ...  또는  @request_embedding_scope()
+    진입 시 빈 dict를 바인딩하고, 종료 시 이전 값으로 복원.
+    """
+    token = _REQUEST_VECTORS.set({})
+    try:
+        yield
+    finally:
+        _REQUEST_VECTORS.reset(token)
+
+
+def lookup(key: str) -> Optional[Any]:
+    memo = _REQUEST_VECTORS.get()
+    if memo is None:
+        return None
+    return memo.get(key)
+
+
+def store(key: str, vector: Any) -> None:
+    memo = _REQUEST_VECTORS.get()
+    if memo is None or vector is None:
+        return
+    memo[key] = vector
@@ -0,0 +1,36 @@
+# service/http_clients.py
+from __future__ import annotations
+
+import importlib.util
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+# 외부 API(CLOVA STT / Papago 등) 공용 세션
+# - 호스트별 커넥션을 keep-alive로 재사용 → 두 번째 호출부터 TCP/TLS 핸드셰이크 생략
+# - requests.Session은 요청 단위로는 thread-safe하게 쓸 수 있음(헤더/쿠키 변경 없이 사용)
+_POOL_CONNECTIONS = 10
+_POOL_MAXSIZE = 20
+
+
+def _build_session() -> requests.Session:
+    s = requests.Session()
+    adapter = HTTPAdapter(pool_connections=_POOL_CONNECTIONS, pool_maxsize=_POOL_MAXSIZE)
+    s.mount("https://", adapter)
+    s.mount("http://", adapter)
+    return s
+
+
+http_session = _build_session()
+
+# h2 패키지가 있으면 HTTP/2로 동시 요청을 커넥션 하나에 다중화(없으면 HTTP/1.1 keep-alive 풀)
+_HTTP2 = importlib.util.find_spec("h2") is not None
+_OPENAI_TIMEOUT = httpx.Timeout(30.0, connect=10.0)
+_OPENAI_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=30.0)
+
+# OpenAI SDK(ChatOpenAI 등)에 넘길 공용 httpx 클라이언트 → 같은 TLS 커넥션 풀 재사용
+openai_http_client = httpx.Client(http2=_HTTP2, timeout=_OPENAI_TIMEOUT, limits=_OPENAI_LIMITS)
+
+# AsyncOpenAI(STT async 경로)용 공용 클라이언트
+openai_async_http_client = httpx.AsyncClient(http2=_HTTP2, timeout=_OPENAI_TIMEOUT, limits=_OPENAI_LIMITS)
@@ -1,28 +1,35 @@
 # service/llm_service.py
 from __future__ import annotations
 
+import asyncio
 import logging
+import queue
 import re
 import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime, timezone
-from decimal import Decimal
-from typing import Any, Dict, List, Literal, Optional, Union
+from typing import Any, Callable, Dict, Iterator, List, Literal, Optional, Union
 
+import orjson
 from fastapi import HTTPException, status
-from fastapi.encoders import jsonable_encoder
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy import text as sa_text
 from sqlalchemy.orm import Session
 
 from core import config
+from database.session import SessionLocal
 from core.pricing import estimate_whisper_stt
 from crud import api_cost as crud_cost
 from crud import chat as crud_chat
 from crud import chat_history as crud_chat_history
-from langchain_service.llm.runner import _run_qa
+from crud import model as crud_model
 from schemas.llm import ChatQARequest, QAResponse, STTResponse
+from service.embedding_ctx import request_embedding_scope
+from service.qa_cache import qa_cache
 from service.stt import (
     ensure_wav_16k_mono,
     openai_transcribe,
+    openai_transcribe_async,
     probe_duration_seconds,
     wav_duration_seconds,
 )
@@ -35,6 +42,12 @@ log = logging.getLogger("api_cost")
 _USE_QC_EMBEDDING: bool = bool(getattr(config, "CHAT_CATEGORY_USE_EMBEDDING", False))
 _DEFAULT_CHANNEL = "web"
 
+# runner(langchain/openai 체인)는 첫 QA 호출 때 import 후 캐시
+_RUN_QA = None
+
+# STT 비용 기록을 QA와 겹쳐 돌리기 위한 풀
+_STT_COST_POOL = ThreadPoolExecutor(max_workers=config.STT_COST_WORKERS, thread_name_prefix="stt-cost")
+
 
 # 아주 가벼운 룰(초기버전). quick_category.name이 한글/영문 어떤 형태든 매칭되게 "후보 토큰"을 넓게 둠.
 _RULES: list[tuple[list[str], list[str]]] = [
@@ -46,6 +59,80 @@ _RULES: list[tuple[list[str], list[str]]] = [
 ]
 
 
+def _get_run_qa():
+    global _RUN_QA
+    if _RUN_QA is None:
+        from langchain_service.llm.runner import _run_qa
+
+        _RUN_QA = _run_qa
+    return _RUN_QA
+
+
+def _run_qa_cached(
+    db: Session,
+    *,
+    question: str,
+    knowledge_id: Optional[int],
+    top_k: int,
+    session_id: Optional[int],
+    policy_flags: dict,
+    style: Optional[str],
+    few_shot_profile: str,
+    on_token: Optional[Callable[[str], None]] = None,
+) -> QAResponse:
+    """
+    _run_qa 앞단 시맨틱 캐시.
+    질문 임베딩은 request_embedding_scope에 메모되므로 miss 시 runner 검색에서 그대로 재사용됨.
+    정상(ok) 응답만 캐시.
+    """
+    run_qa = _get_run_qa()
+    if style is None and config.QA_CACHE_ENABLED:
+        # 캐시 키에는 실제 적용될 스타일을 넣음(None 그대로면 관리자가 스타일을 바꿔도 이전 스타일 답변이 hit)
+        m = crud_model.get_single(db)
+        if m is not None:
+            style = m.response_style
+    kwargs = dict(
+        question=question,
+        knowledge_id=knowledge_id,
+        top_k=top_k,
+        session_id=session_id,
+        policy_flags=policy_flags,
+        style=style,
+        few_shot_profile=few_shot_profile,
+    )
+    if on_token is not None:
+        kwargs.update(streaming=True, on_token=on_token)
+    if not config.QA_CACHE_ENABLED:
+        return run_qa(db, **kwargs)
+
+    from langchain_service.embedding.get_vector import text_to_vector
+
+    key = qa_cache.make_key(
+        knowledge_id=knowledge_id,
+        top_k=top_k,
+        style=style,
+        few_shot_profile=few_shot_profile,
+        policy_flags=policy_flags,
+    )
+    vector = text_to_vector(question)
+    cached = qa_cache.get(key, vector)
+    if cached is not None:
+        # run_qa를 건너뛰므로 run_qa가 하던 user 메시지 벡터 기록은 여기서(이미 계산한 벡터 재사용)
+        if session_id is not None and vector is not None:
+            crud_chat.set_last_user_vector(db, session_id, vector.tolist())
+        # 캐시된 응답의 질문/세션은 이번 요청 기준으로 교체
+        cached.question = question
+        cached.session_id = session_id
+        if on_token is not None:
+            on_token(cached.answer)
+        return cached
+
+    resp = run_qa(db, **kwargs)
+    if resp is not None and resp.status == "ok":
+        qa_cache.put(key, vector, resp)
+    return resp
+
+
 def _ensure_session(db: Session, session_id: int) -> None:
     if not crud_chat.get_session(db, session_id):
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="session not found")
@@ -60,14 +147,16 @@ def _extract_policy_flags(obj: Any) -> dict:
     return flags
 
 
-def _dump_sources(resp: QAResponse) -> list[dict]:
-    out: list[dict] = []
-    for s in (getattr(resp, "sources", None) or []):
-        if hasattr(s, "model_dump"):
-            out.append(s.model_dump())
-        else:
-            out.append(jsonable_encoder(s))
-    return out
+# assistant message extra_data에 남길 응답 필드
+_RESP_EXTRA_FIELDS = {"sources", "citations", "status", "reason_code", "retrieval_meta"}
+
+
+def _dump_resp_extra(resp: QAResponse) -> dict:
+    """
+    응답 트리를 한 번만 순회해서 JSON-safe dict로 변환(mode="json").
+    sources/citations를 따로 dump한 뒤 jsonable_encoder로 다시 감싸지 않음.
+    """
+    return resp.model_dump(mode="json", include=_RESP_EXTRA_FIELDS)
 
 
 def _record_failure_suggestion(
@@ -75,15 +164,12 @@ def _record_failure_suggestion(
     *,
     session_id: int,
     question_text: str,
-    assistant_message: Any,
+    message_id: Optional[int],
     resp: QAResponse,
 ) -> None:
     if getattr(resp, "status", None) == "ok":
         return
 
-    message_id = getattr(assistant_message, "id", None) or getattr(
-        assistant_message, "message_id", None
-    )
     if not message_id:
         log.warning("knowledge_suggestion skipped: missing message_id")
         return
@@ -285,7 +371,7 @@ def _record_user_message_and_update_insights(
         response_latency_ms=None,
         extra_data=extra_data,
         commit=False,
-        refresh=True,
+        refresh=False,  # eager_defaults로 id/created_at은 flush 시 채워짐
     )
 
     # 2) keywords
@@ -351,7 +437,11 @@ def _coerce_policy_refusal_status(resp: QAResponse) -> None:
         resp.reason_code = getattr(resp, "reason_code", None) or "OUT_OF_SCOPE"
 
 
-def ask_in_session_service(db: Session, *, session_id: int, payload: ChatQARequest) -> QAResponse:
+def _begin_session_qa(db: Session, *, session_id: int, payload: ChatQARequest) -> dict:
+    """
+    세션 QA 공통 전처리: 검증 + Tx1(user message + insights).
+    반환값은 assistant message extra_data의 공통 필드(policy_flags/few_shot_profile/channel 포함).
+    """
     _ensure_session(db, session_id)
 
     if getattr(payload, "role", "user") != "user":
@@ -386,61 +476,44 @@ def ask_in_session_service(db: Session, *, session_id: int, payload: ChatQAReque
         db.rollback()
         raise
 
-    t0 = time.perf_counter()
-    resp = _run_qa(
-        db,
-        question=payload.question,
-        knowledge_id=payload.knowledge_id,
-        top_k=payload.top_k,
-        session_id=session_id,
-        policy_flags=flags,
-        style=payload.style,
-        few_shot_profile=few_shot_profile,
-    )
-    _coerce_policy_refusal_status(resp)
-    latency_ms = int((time.perf_counter() - t0) * 1000)
+    return {
+        "knowledge_id": payload.knowledge_id,
+        "top_k": payload.top_k,
+        "style": payload.style,
+        "policy_flags": flags,
+        "few_shot_profile": few_shot_profile,
+        "source": "text",
+        "channel": channel,
+    }
 
-    if resp is None:
-        raise HTTPException(status_code=502, detail="_run_qa returned None")
 
-    # Tx2) assistant message 기록
+def _finish_session_qa(
+    db: Session,
+    *,
+    session_id: int,
+    question: str,
+    base_extra: dict,
+    resp: QAResponse,
+    latency_ms: int,
+) -> None:
+    # Tx2) assistant message 기록 (+ 실패 시 session_insight 갱신을 같은 문장에서)
+    failed = resp.status != "ok"
     try:
-        msg = crud_chat.create_message(
+        message_id = crud_chat.create_message_and_maybe_mark_failed(
             db,
             session_id=session_id,
-            role="assistant",
             content=resp.answer,
-            vector_memory=None,
             response_latency_ms=latency_ms,
-            extra_data=jsonable_encoder(
-                {
-                    "knowledge_id": payload.knowledge_id,
-                    "top_k": payload.top_k,
-                    "style": payload.style,
-                    "policy_flags": flags,
-                    "few_shot_profile": few_shot_profile,
-                    "sources": _dump_sources(resp),
-                    "source": "text",
-                    "channel": channel,
-                    "status": resp.status,
-                    "reason_code": resp.reason_code,
-                    "retrieval_meta": getattr(resp, "retrieval_meta", None),
-                    "citations": [c.model_dump() for c in resp.citations],
-                }
-            ),
-            commit=False,   # 여기서 바로 커밋하지 않고
-            refresh=True,
+            failed=failed,
+            failed_reason=resp.answer[:200] if failed else None,
+            extra_data={**base_extra, **_dump_resp_extra(resp)},
         )
-        if resp.status != "ok":
-            ins = crud_chat_history.ensure_session_insight(db, session_id=session_id)
-            ins.status = "failed"
-            ins.failed_reason = resp.answer[:200]
-            db.add(ins)
+        if failed:
             _record_failure_suggestion(
                 db,
                 session_id=session_id,
-                question_text=payload.question,
-                assistant_message=msg,
+                question_text=question,
+                message_id=message_id,
                 resp=resp,
             )
         db.commit()        # 함수 레벨에서 확정
@@ -448,33 +521,175 @@ def ask_in_session_service(db: Session, *, session_id: int, payload: ChatQAReque
         db.rollback()
         raise
 
+
+@request_embedding_scope()
+def ask_in_session_service(db: Session, *, session_id: int, payload: ChatQARequest) -> QAResponse:
+    base_extra = _begin_session_qa(db, session_id=session_id, payload=payload)
+
+    t0 = time.perf_counter()
+    resp = _run_qa_cached(
+        db,
+        question=payload.question,
+        knowledge_id=payload.knowledge_id,
+        top_k=payload.top_k,
+        session_id=session_id,
+        policy_flags=base_extra["policy_flags"],
+        style=payload.style,
+        few_shot_profile=base_extra["few_shot_profile"],
+    )
+    _coerce_policy_refusal_status(resp)
+    latency_ms = int((time.perf_counter() - t0) * 1000)
+
+    if resp is None:
+        raise HTTPException(status_code=502, detail="_run_qa returned None")
+
+    _finish_session_qa(
+        db,
+        session_id=session_id,
+        question=payload.question,
+        base_extra=base_extra,
+        resp=resp,
+        latency_ms=latency_ms,
+    )
     return resp
 
 
+# =========================================================
+# streaming QA (SSE)
+# =========================================================
+_META_MARKER = "<!--"
 
-def stt_service(
-    db: Session,
+# 스트리밍 QA 워커(LLM 호출 ~ assistant 기록까지 한 스레드에서 처리)
+_QA_STREAM_POOL = ThreadPoolExecutor(max_workers=config.QA_STREAM_WORKERS, thread_name_prefix="qa-stream")
+
+
+class _AnswerDeltaFilter:
+    """
+    runner가 답변 끝에 붙이는 메타데이터 주석(<!-- STATUS ... -->)은 클라이언트로 흘리지 않음.
+    마커가 조각 경계에 걸칠 수 있어서 마지막 몇 글자는 다음 조각까지 보류.
+    """
+
+    def __init__(self) -> None:
+        self._buf = ""
+        self._closed = False
+
+    def feed(self, piece: str) -> str:
+        if self._closed:
+            return ""
+        self._buf += piece
+        i = self._buf.find(_META_MARKER)
+        if i >= 0:
+            out, self._buf, self._closed = self._buf[:i], "", True
+            return out
+        keep = len(_META_MARKER) - 1
+        if len(self._buf) <= keep:
+            return ""
+        out, self._buf = self._buf[:-keep], self._buf[-keep:]
+        return out
+
+    def flush(self) -> str:
+        out, self._buf = ("" if self._closed else self._buf), ""
+        return out
+
+
+def _sse(event: dict) -> str:
+    return "data: " + orjson.dumps(event).decode() + "\n\n"
+
+
+@request_embedding_scope()
+def _stream_session_qa_worker(
+    events: "queue.Queue[Optional[dict]]",
     *,
-    raw: bytes,
-    content_type: str,
-    lang: str,
-    knowledge_id: Optional[int],
-    top_k: int,
-    session_id: Optional[int],
-    style: Optional[str],
-    block_inappropriate: Optional[bool],
-    restrict_non_tech: Optional[bool],
-    suggest_agent_handoff: Optional[bool],
-    few_shot_profile: str,
-) -> Union[STTResponse, QAResponse]:
-    wav = ensure_wav_16k_mono(raw, content_type)
+    session_id: int,
+    payload: ChatQARequest,
+    base_extra: dict,
+) -> None:
+    # 요청 세션(get_db)은 스트리밍 도중 정리될 수 있어서 별도 세션 사용
+    db = SessionLocal()
+    delta_filter = _AnswerDeltaFilter()
+
+    def _on_token(piece: str) -> None:
+        out = delta_filter.feed(piece)
+        if out:
+            events.put({"type": "delta", "text": out})
+
+    try:
+        t0 = time.perf_counter()
+        resp = _run_qa_cached(
+            db,
+            question=payload.question,
+            knowledge_id=payload.knowledge_id,
+            top_k=payload.top_k,
+            session_id=session_id,
+            policy_flags=base_extra["policy_flags"],
+            style=payload.style,
+            few_shot_profile=base_extra["few_shot_profile"],
+            on_token=_on_token,
+        )
+        if resp is None:
+            raise HTTPException(status_code=502, detail="_run_qa returned None")
+        _coerce_policy_refusal_status(resp)
+        latency_ms = int((time.perf_counter() - t0) * 1000)
+
+        tail = delta_filter.flush()
+        if tail:
+            events.put({"type": "delta", "text": tail})
+
+        _finish_session_qa(
+            db,
+            session_id=session_id,
+            question=payload.question,
+            base_extra=base_extra,
+            resp=resp,
+            latency_ms=latency_ms,
+        )
+        events.put({"type": "done", "response": resp.model_dump(mode="json")})
+    except HTTPException as e:
+        events.put({"type": "error", "status_code": e.status_code, "detail": e.detail})
+    except Exception:
+        log.exception("streaming QA failed: session_id=%s", session_id)
+        events.put({"type": "error", "status_code": 500, "detail": "QA 처리에 실패했습니다."})
+    finally:
+        events.put(None)
+        db.close()
+
+
+def ask_in_session_stream_service(
+    db: Session, *, session_id: int, payload: ChatQARequest
+) -> Iterator[str]:
+    """
+    ask_in_session_service의 SSE 버전.
+    - 검증/Tx1은 응답 시작 전에 수행(오류는 일반 HTTP 에러로 반환)
+    - 이후 이벤트: delta(답변 조각) … → done(최종 QAResponse) | error
+    """
+    base_extra = _begin_session_qa(db, session_id=session_id, payload=payload)
+
+    events: "queue.Queue[Optional[dict]]" = queue.Queue()
+    _QA_STREAM_POOL.submit(
+        _stream_session_qa_worker,
+        events,
+        session_id=session_id,
+        payload=payload,
+        base_extra=base_extra,
+    )
 
-    # 1) STT
-    text = openai_transcribe(wav, lang).strip()
-    if not text:
-        raise HTTPException(status_code=422, detail="empty transcription")
+    def _iter() -> Iterator[str]:
+        while True:
+            event = events.get()
+            if event is None:
+                return
+            yield _sse(event)
 
-    # 2) 길이 산출 → 비용 기록
+    return _iter()
+
+
+
+def _record_stt_cost(raw: bytes, wav: bytes) -> None:
+    """
+    STT 길이 산출 + 비용 기록.
+    요청 세션(db)과 분리된 SessionLocal을 써서 QA와 동시에 돌려도 안전하고,
+    QA가 실패해도 STT 비용은 그대로 커밋됨.
+    """
     secs = wav_duration_seconds(wav)
     if secs <= 0:
         secs = probe_duration_seconds(raw)
@@ -482,6 +697,7 @@ def stt_service(
         log.warning("STT duration fallback to 6s (default)")
         secs = 6.0
 
+    db = SessionLocal()
     try:
         usd = estimate_whisper_stt(float(secs), model="gpt-4o-mini-transcribe")
         crud_cost.add_event(
@@ -495,8 +711,126 @@ def stt_service(
             cost_usd=usd,
         )
     except Exception as e:
+        db.rollback()
         log.exception("api-cost stt record failed: %s", e)
+    finally:
+        db.close()
+
+
+def stt_service(
+    db: Session,
+    *,
+    raw: bytes,
+    content_type: str,
+    lang: str,
+    knowledge_id: Optional[int],
+    top_k: int,
+    session_id: Optional[int],
+    style: Optional[str],
+    block_inappropriate: Optional[bool],
+    restrict_non_tech: Optional[bool],
+    suggest_agent_handoff: Optional[bool],
+    few_shot_profile: str,
+) -> Union[STTResponse, QAResponse]:
+    wav = ensure_wav_16k_mono(raw, content_type)
 
+    # 길이 산출 → 비용 기록: STT 호출/QA와 겹치도록 원격 STT 직전에 별도 세션/스레드에서 시작
+    # (오디오를 보낸 시점에 과금되므로 전사 결과가 비어도 기록, STT 캐시 히트면 과금 없음 → 기록 안 함)
+    cost_futures: List[Future] = []
+    try:
+        # 1) STT
+        text = openai_transcribe(
+            wav, lang, on_miss=lambda: cost_futures.append(_STT_COST_POOL.submit(_record_stt_cost, raw, wav))
+        ).strip()
+        if not text:
+            raise HTTPException(status_code=422, detail="empty transcription")
+
+        # 2) QA(선택)
+        return _stt_answer(
+            db,
+            text=text,
+            lang=lang,
+            knowledge_id=knowledge_id,
+            top_k=top_k,
+            session_id=session_id,
+            style=style,
+            block_inappropriate=block_inappropriate,
+            restrict_non_tech=restrict_non_tech,
+            suggest_agent_handoff=suggest_agent_handoff,
+            few_shot_profile=few_shot_profile,
+        )
+    finally:
+        for fut in cost_futures:
+            fut.result()
+
+
+async def stt_service_async(
+    db: Session,
+    *,
+    raw: bytes,
+    content_type: str,
+    lang: str,
+    knowledge_id: Optional[int],
+    top_k: int,
+    session_id: Optional[int],
+    style: Optional[str],
+    block_inappropriate: Optional[bool],
+    restrict_non_tech: Optional[bool],
+    suggest_agent_handoff: Optional[bool],
+    few_shot_profile: str,
+) -> Union[STTResponse, QAResponse]:
+    """
+    stt_service의 async 버전.
+    - ffmpeg 변환/QA(동기 DB·LLM)는 스레드풀, 원격 STT 대기는 이벤트 루프에서 await
+    """
+    wav = await run_in_threadpool(ensure_wav_16k_mono, raw, content_type)
+
+    cost_futures: List[Future] = []
+    try:
+        # 1) STT
+        text = (
+            await openai_transcribe_async(
+                wav, lang, on_miss=lambda: cost_futures.append(_STT_COST_POOL.submit(_record_stt_cost, raw, wav))
+            )
+        ).strip()
+        if not text:
+            raise HTTPException(status_code=422, detail="empty transcription")
+
+        # 2) QA(선택)
+        return await run_in_threadpool(
+            _stt_answer,
+            db,
+            text=text,
+            lang=lang,
+            knowledge_id=knowledge_id,
+            top_k=top_k,
+            session_id=session_id,
+            style=style,
+            block_inappropriate=block_inappropriate,
+            restrict_non_tech=restrict_non_tech,
+            suggest_agent_handoff=suggest_agent_handoff,
+            few_shot_profile=few_shot_profile,
+        )
+    finally:
+        for fut in cost_futures:
+            await asyncio.wrap_future(fut)
+
+
+@request_embedding_scope()
+def _stt_answer(
+    db: Session,
+    *,
+    text: str,
+    lang: str,
+    knowledge_id: Optional[int],
+    top_k: int,
+    session_id: Optional[int],
+    style: Optional[str],
+    block_inappropriate: Optional[bool],
+    restrict_non_tech: Optional[bool],
+    suggest_agent_handoff: Optional[bool],
+    few_shot_profile: str,
+) -> Union[STTResponse, QAResponse]:
     # 3) QA 여부
     qa_mode = any(
         [
@@ -543,7 +877,7 @@ def stt_service(
         )
 
     t0 = time.perf_counter()
-    resp = _run_qa(
+    resp = _run_qa_cached(
         db,
         question=text,
         knowledge_id=knowledge_id,
@@ -560,42 +894,31 @@ def stt_service(
         raise HTTPException(status_code=502, detail="_run_qa returned None")
 
     if session_id is not None:
-        msg = crud_chat.create_message(
+        failed = resp.status != "ok"
+        message_id = crud_chat.create_message_and_maybe_mark_failed(
             db,
             session_id=session_id,
-            role="assistant",
             content=resp.answer,
-            vector_memory=None,
             response_latency_ms=latency_ms,
-            extra_data=jsonable_encoder(
-                {
-                    "knowledge_id": knowledge_id,
-                    "top_k": top_k,
-                    "style": style,
-                    "policy_flags": flags,
-                    "few_shot_profile": few_shot_profile,
-                    "sources": _dump_sources(resp),
-                    "source": "voice",
-                    "lang": lang,
-                    "status": resp.status,
-                    "reason_code": resp.reason_code,
-                    "retrieval_meta": getattr(resp, "retrieval_meta", None),
-                    "citations": [c.model_dump() for c in resp.citations],
-                }
-            ),
-            commit=False,
-            refresh=True,
+            failed=failed,
+            failed_reason=resp.answer[:200] if failed else None,
+            extra_data={
+                "knowledge_id": knowledge_id,
+                "top_k": top_k,
+                "style": style,
+                "policy_flags": flags,
+                "few_shot_profile": few_shot_profile,
+                "source": "voice",
+                "lang": lang,
+                **_dump_resp_extra(resp),
+            },
         )
-        if resp.status != "ok":
-            ins = crud_chat_history.ensure_session_insight(db, session_id=session_id)
-            ins.status = "failed"
-            ins.failed_reason = resp.answer[:200]
-            db.add(ins)
+        if failed:
             _record_failure_suggestion(
                 db,
                 session_id=session_id,
                 question_text=text,
-                assistant_message=msg,
+                message_id=message_id,
                 resp=resp,
             )
 
@@ -3,7 +3,7 @@ from __future__ import annotations
 
 from typing import List, Optional, Any, Dict
 
-from sqlalchemy import select
+from sqlalchemy import delete, select
 from sqlalchemy.orm import Session
 
 from langchain_core.chat_history import BaseChatMessageHistory
@@ -24,25 +24,33 @@ class PostgresChatMessageHistory(BaseChatMessageHistory):
         self.session_id = int(session_id)
         self.k = max(1, int(k))
         self._last_ai_message_id: Optional[int] = None
+        # 체인이 한 턴에 messages를 여러 번 읽으므로 1회만 조회(add_message/clear 시 무효화)
+        self._cached: Optional[List[BaseMessage]] = None
 
     @property
     def messages(self) -> List[BaseMessage]:
+        if self._cached is not None:
+            return list(self._cached)
+
+        # role/content만 조회(vector_memory 등 무거운 컬럼 로드 X)
+        # 정렬은 idx_message_session_created(session_id, created_at)를 그대로 타도록 유지
         stmt = (
-            select(Message)
+            select(Message.role, Message.content)
             .where(Message.session_id == self.session_id)
             .order_by(Message.created_at.desc(), Message.id.desc())
             .limit(self.k)
         )
-        rows = list(self.db.scalars(stmt).all())
+        rows = list(self.db.execute(stmt).all())
         rows.reverse()  # 오래된 -> 최신 순으로
 
         out: List[BaseMessage] = []
-        for r in rows:
-            if r.role == "user":
-                out.append(HumanMessage(content=r.content))
-            elif r.role == "assistant":
-                out.append(AIMessage(content=r.content))
-        return out
+        for role, content in rows:
+            if role == "user":
+                out.append(HumanMessage(content=content))
+            elif role == "assistant":
+                out.append(AIMessage(content=content))
+        self._cached = out
+        return list(out)
 
     def add_message(self, message: BaseMessage) -> None:
         # DB 제약: role IN ('user','assistant') 이라 system은 저장 불가 -> 무시
@@ -72,17 +80,19 @@ class PostgresChatMessageHistory(BaseChatMessageHistory):
         )
         self.db.add(obj)
         self.db.flush()  # id 확보
+        self._cached = None
 
         if role == "assistant":
             self._last_ai_message_id = obj.id
 
     def clear(self) -> None:
         # 필요하면 구현. 운영에서는 보통 세션 종료(ended_at)만 찍고 메시지는 남김.
-        stmt = select(Message.id).where(Message.session_id == self.session_id)
-        ids = [x for x in self.db.scalars(stmt).all()]
-        if not ids:
-            return
-        self.db.query(Message).filter(Message.id.in_(ids)).delete(synchronize_session=False)
+        self._cached = None
+        self.db.execute(
+            delete(Message)
+            .where(Message.session_id == self.session_id)
+            .execution_options(synchronize_session=False)
+        )
         self.db.flush()
 
     def set_last_ai_latency(self, latency_ms: int) -> None:
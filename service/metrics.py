@@ -3,6 +3,9 @@ from sqlalchemy import text
 from sqlalchemy.orm import Session
 from crud import model as crud_model
 
+# 여러 워커가 동시에 스케줄 잡을 돌려도 1곳만 집계하도록 쓰는 advisory lock 키
+_METRICS_LOCK_KEY = 7301
+
 
 ## 주석 참고
 def recompute_model_metrics(db: Session) -> None:
@@ -13,46 +16,51 @@ def recompute_model_metrics(db: Session) -> None:
     - accuracy             : 피드백 기반 정확도(%). 숫자 평점(>=4) 또는 helpful/unhelpful 해석
     - uptime_percent       : 어시스턴트 응답 성공률(%). extra_data->>'error' 없음 = 성공
     """
-    # 어시스턴트 메시지의 응답지연 평균(이번 달). 값이 없으면 0
-    avg_ms = db.execute(text("""
-        SELECT COALESCE(AVG(response_latency_ms), 0)
-        FROM message
-        WHERE role='assistant' AND created_at >= date_trunc('month', now())
-    """)).scalar() or 0
-
-    # 이번 달 생성된 대화 세션 개수
-    month_convs = db.execute(text("""
-        SELECT COUNT(*) FROM chat_session
-        WHERE created_at >= date_trunc('month', now())
-    """)).scalar() or 0
-
-    # 정확도(%): rating이 숫자면 4점 이상을 정답(1)으로, 문자열이면 helpful=1, unhelpful=0로 환산
-    # 숫자 캐스팅 안전을 위해 정규식으로 숫자 문자열만 ::numeric 처리
-    accuracy = db.execute(text("""
-        SELECT COALESCE(
-          AVG(
+    # 지표 4종을 한 번에 조회(message는 1회만 스캔)
+    # - avg_ms      : 어시스턴트 메시지의 응답지연 평균(이번 달). 값이 없으면 0
+    # - month_convs : 이번 달 생성된 대화 세션 개수
+    # - accuracy(%) : rating이 숫자면 4점 이상을 정답(1)으로, 문자열이면 helpful=1, unhelpful=0로 환산
+    #                 숫자 캐스팅 안전을 위해 정규식으로 숫자 문자열만 ::numeric 처리
+    # - uptime(%)   : 이번 달 어시스턴트 메시지 중 오류가 없는 비율
+    #                 분모가 0이면 NULL → COALESCE로 100 처리(무가동 기간 오해 방지)
+    row = db.execute(text("""
+        WITH m AS (
+          SELECT
+            AVG(response_latency_ms) AS avg_ms,
+            (COUNT(*) FILTER (WHERE (extra_data->>'error') IS NULL))::float
+              / NULLIF(COUNT(*),0) * 100 AS uptime
+          FROM message
+          WHERE role='assistant' AND created_at >= date_trunc('month', now())
+        ),
+        c AS (
+          SELECT COUNT(*) AS n
+          FROM chat_session
+          WHERE created_at >= date_trunc('month', now())
+        ),
+        f AS (
+          SELECT AVG(
             CASE
               WHEN rating ~ '^[0-9]+(\\.[0-9]+)?$' AND rating::numeric >= 4 THEN 1
               WHEN rating ILIKE 'helpful'   THEN 1
               WHEN rating ILIKE 'unhelpful' THEN 0
               ELSE NULL   -- 해석 불가 데이터는 평균에서 제외
             END
-          ) * 100, 0
+          ) * 100 AS acc
+          FROM feedback
+          WHERE created_at >= date_trunc('month', now())
         )
-        FROM feedback
-        WHERE created_at >= date_trunc('month', now())
-    """)).scalar() or 0
+        SELECT
+          COALESCE(m.avg_ms, 0) AS avg_ms,
+          c.n AS month_convs,
+          COALESCE(f.acc, 0) AS accuracy,
+          COALESCE(m.uptime, 100) AS uptime
+        FROM m, c, f
+    """)).first()
 
-    # 가동률(%): 이번 달 어시스턴트 메시지 중 오류가 없는 비율
-    # 분모가 0이면 NULL → COALESCE로 100 처리(무가동 기간 오해 방지)
-    uptime = db.execute(text("""
-        SELECT COALESCE(
-          (COUNT(*) FILTER (WHERE (extra_data->>'error') IS NULL))::float
-          / NULLIF(COUNT(*),0) * 100, 100
-        )
-        FROM message
-        WHERE role='assistant' AND created_at >= date_trunc('month', now())
-    """)).scalar() or 100
+    avg_ms = (row.avg_ms if row else 0) or 0
+    month_convs = (row.month_convs if row else 0) or 0
+    accuracy = (row.accuracy if row else 0) or 0
+    uptime = (row.uptime if row else 100) or 100
 
     # 집계값을 싱글톤 model에 반영
     crud_model.update_metrics(
@@ -62,3 +70,18 @@ def recompute_model_metrics(db: Session) -> None:
         month_conversations=int(month_convs),     # Integer 대상
         uptime_percent=float(uptime),             # Numeric(5,2) 대상
     )
+
+
+def try_recompute_model_metrics(db: Session) -> bool:
+    """
+    스케줄러용: advisory lock(트랜잭션 단위)을 잡은 경우에만 집계.
+    update_metrics의 commit 시 lock도 함께 해제된다.
+    """
+    got = db.execute(
+        text("SELECT pg_try_advisory_xact_lock(:k)"), {"k": _METRICS_LOCK_KEY}
+    ).scalar()
+    if not got:
+        db.rollback()
+        return False
+    recompute_model_metrics(db)
+    return True
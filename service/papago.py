@@ -1,9 +1,7 @@
 # 파파고(네이버, 클로바와 동시 확인 가능)
 ## 예제 코드(한국어 <->중국어)
 
-import os
-import sys
-import urllib.request
+from service.http_clients import http_session
 
 # 1. 환경변수
 
@@ -11,19 +9,24 @@ import urllib.request
 client_id = "YOUR_CLIENT_ID"
 client_secret = "YOUR_CLIENT_SECRET"
 
-encText = urllib.parse.quote("번역할 문장을 입력하세요")
-data = "source=ko&target=en&text=" + encText
 url = "https://papago.apigw.ntruss.com/nmt/v1/translation"
 
-request = urllib.request.Request(url)
-request.add_header("X-NCP-APIGW-API-KEY-ID",client_id)
-request.add_header("X-NCP-APIGW-API-KEY",client_secret)
-response = urllib.request.urlopen(request, data=data.encode("utf-8"))
 
-rescode = response.getcode()
-
-if(rescode==200):
-    response_body = response.read()
-    print(response_body.decode('utf-8'))
-else:
-    print("Error Code:" + rescode)
+def translate(text: str, source: str = "ko", target: str = "en") -> str:
+    # 공용 세션(keep-alive) 재사용 → 호출마다 TLS 핸드셰이크 하지 않음
+    response = http_session.post(
+        url,
+        headers={
+            "X-NCP-APIGW-API-KEY-ID": client_id,
+            "X-NCP-APIGW-API-KEY": client_secret,
+        },
+        data={"source": source, "target": target, "text": text},
+        timeout=10,
+    )
+    if response.status_code != 200:
+        raise RuntimeError("Error Code:" + str(response.status_code))
+    return response.text
+
+
+if __name__ == "__main__":
+    print(translate("번역할 문장을 입력하세요"))
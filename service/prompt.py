@@ -1,23 +1,224 @@
 # 우선 META LLM MSP에서 넘어옴
 
-import json
-
 # from langchain_service.langsmith import logging
-from langchain_community.document_loaders import PyPDFLoader
+from langchain_core.exceptions import OutputParserException
+from langchain_core.output_parsers import JsonOutputParser
 from langchain_core.prompts import PromptTemplate
 from core.config import OPENAI_API, DEFAULT_CHAT_MODEL
-from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate
-import os
+from collections import OrderedDict
+from copy import deepcopy
+from functools import lru_cache
+import hashlib
+import heapq
+import threading
+from operator import itemgetter
+from typing import Optional
+
+import numpy as np
+import tiktoken
+
+from service.http_clients import openai_http_client
+
+# pdf_preview_prompt에 넘길 본문 토큰 상한
+PREVIEW_MAX_TOKENS = 2500
+_PREVIEW_ENC = None
 
 
-llm = ChatOpenAI(
-    model='gpt-4o', temperature=0,
-    # model_name=DEFAULT_CHAT_MODEL,
-    # streaming=False,
-    openai_api_key=OPENAI_API
+@lru_cache(maxsize=None)
+def _get_llm():
+    # import 시점이 아니라 첫 호출 때 생성(langchain_openai/httpx 로드 포함), 이후 재사용
+    from langchain_openai import ChatOpenAI
+
+    return ChatOpenAI(
+        model='gpt-4o', temperature=0,
+        # model_name=DEFAULT_CHAT_MODEL,
+        # streaming=False,
+        openai_api_key=OPENAI_API,
+        max_retries=2,
+        timeout=30,
+        http_client=openai_http_client,
+    )
+
+
+# 프롬프트/체인은 모듈 로드 시 1회만 구성(호출마다 템플릿 파싱 X)
+_RAG_PROMPT = ChatPromptTemplate.from_messages([
+    (
+        "system",
+        """당신은 가람포스텍 RAG 시스템의 응답자입니다.
+        아래는 검색된 지식베이스 내용입니다:
+
+        {knowledge_texts}
+
+        규칙:
+        1. 제공된 지식만 사용하여 답변할 것. 질문 문장을 그대로 반복하지 말 것.
+        2. 원문의 핵심 구절(사훈, 표어, 원칙 등)은 반드시 그대로 포함.
+        3. 요약은 허용하되 핵심 구절은 삭제·변형하지 말 것.
+        4. 답변은 번호 목록 또는 불릿포인트로 구조화해 깔끔하게 출력.
+        5. '원문 인용' 같은 라벨은 출력하지 말 것.
+        6. 최대 10줄 이내로 유지.""",
+    ),
+    ("human", "{user_input}"),
+])
+
+_PDF_PREVIEW_PROMPT = PromptTemplate(
+    input_variables=["input_text"],
+    template="""
+              "{input_text}"
+              위 내용을 요약해서 아래 JSON 형식으로만 답변하세요:
+              {{
+                  "tags": ["...","...","...","..."],
+                  "preview": "..."
+              }}
+              """
+)
+
+_PREVIEW_PROMPT = PromptTemplate(
+    input_variables=["input"],
+    template="""
+    다음은 사용자가 보낸 요청입니다:
+    "{input}"
+    위 내용을 요약해서 아래 JSON 형식으로만 답변하세요:
+    {{
+        "title": "...",
+        "preview": "..."
+    }}
+    """
 )
 
+_INTENT_PROMPT = PromptTemplate(
+    input_variables=["input"],
+    template="""
+    당신은 AI 모델 추천 어드바이저입니다. 
+    사용자의 메시지를 분석하여 적절한 LLM 모델을 추천하세요. 
+
+    분석 기준:
+    - 언어 (한국어 / 영어 / 혼합)
+    - 도메인 (일상, 금융, 법률, 의료, 학술 등)
+    - 복잡도 (낮음 / 중간 / 높음)
+    - 정확도 중요도 (낮음 / 중간 / 높음)
+    - 창의성 필요성 (낮음 / 중간 / 높음)
+    - 긴급성 (즉시 응답 / 고품질 우선)
+
+    입력 메시지:
+    "{input}"
+
+    출력은 반드시 아래 JSON 형식으로만 답변하세요:
+    {{
+        "analysis": {{
+            "language": "...",
+            "domain": "...",
+            "complexity": "...",
+            "accuracy_importance": "...",
+            "creativity_need": "...",
+            "urgency": "..."
+        }},
+        "recommended_model": "..."
+    }}
+    """
+)
+
+_JSON_PROMPTS = {
+    "pdf_preview": _PDF_PREVIEW_PROMPT,
+    "preview": _PREVIEW_PROMPT,
+    "intent": _INTENT_PROMPT,
+}
+
+
+@lru_cache(maxsize=None)
+def _json_chain(name: str):
+    # JSON 응답 전용: OpenAI JSON mode로 코드펜스/잡설 없이 JSON 객체만 받음
+    json_llm = _get_llm().bind(response_format={"type": "json_object"})
+    return _JSON_PROMPTS[name] | json_llm | JsonOutputParser()
+
+
+class _NearDupCache:
+    """
+    JSON 프롬프트 결과 캐시(프롬프트 종류별, 프로세스 단위).
+    - 1차: 입력 텍스트 sha256 완전 일치
+    - 2차: 64-bit SimHash 해밍거리 <= max_distance (재업로드/버전만 다른 문서 재사용)
+      짧은 입력(질문 등)은 SimHash가 불안정해서 완전 일치만 사용
+    """
+
+    def __init__(self, *, max_entries: int = 512, max_distance: int = 3, min_simhash_chars: int = 200):
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self.min_simhash_chars = min_simhash_chars
+        self._items: "OrderedDict[str, tuple[Optional[int], dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _simhash(text: str) -> int:
+        # 문자 4-gram 해시(64bit)의 비트별 다수결
+        grams = {text[i:i + 4] for i in range(max(1, len(text) - 3))}
+        hashes = np.fromiter(
+            (int.from_bytes(hashlib.blake2b(g.encode("utf-8"), digest_size=8).digest(), "big") for g in grams),
+            dtype=np.uint64,
+            count=len(grams),
+        )
+        bits = np.unpackbits(hashes.byteswap().view(np.uint8).reshape(-1, 8), axis=1)
+        votes = bits.sum(axis=0) * 2 > len(grams)
+        return int.from_bytes(np.packbits(votes).tobytes(), "big")
+
+    def get(self, text: str) -> Optional[dict]:
+        key = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        with self._lock:
+            hit = self._items.get(key)
+            if hit is not None:
+                self._items.move_to_end(key)
+                return deepcopy(hit[1])
+        if len(text) < self.min_simhash_chars:
+            return None
+
+        h = self._simhash(text)
+        with self._lock:
+            for k, (other, value) in self._items.items():
+                if other is not None and bin(h ^ other).count("1") <= self.max_distance:
+                    self._items.move_to_end(k)
+                    return deepcopy(value)
+        return None
+
+    def put(self, text: str, value: dict) -> None:
+        key = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        h = self._simhash(text) if len(text) >= self.min_simhash_chars else None
+        with self._lock:
+            self._items[key] = (h, deepcopy(value))
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+
+_JSON_RESULT_CACHES = {name: _NearDupCache() for name in _JSON_PROMPTS}
+
+
+def _invoke_json(name: str, inputs: dict, text: str) -> dict:
+    """
+    _json_chain 호출 + 결과 캐시. 파싱 실패(OutputParserException)는 캐시하지 않고 그대로 올림.
+    """
+    cache = _JSON_RESULT_CACHES[name]
+    cached = cache.get(text)
+    if cached is not None:
+        return cached
+    result = _json_chain(name).invoke(inputs)
+    if isinstance(result, dict):
+        cache.put(text, result)
+    return result
+
+
+# 후보가 이 개수 이상이면 numpy argpartition, 미만이면 heapq
+_NP_SELECT_MIN_ROWS = 256
+
+
+def _smallest_by_similarity(rows: list[dict], k: int) -> list[dict]:
+    if k <= 0:
+        return []
+    if len(rows) < _NP_SELECT_MIN_ROWS or k >= len(rows):
+        return heapq.nsmallest(k, rows, key=itemgetter("similarity"))
+    sims = np.fromiter((r["similarity"] for r in rows), dtype=np.float32, count=len(rows))
+    idx = np.argpartition(sims, k)[:k]
+    idx = idx[np.argsort(sims[idx], kind="stable")]
+    return [rows[i] for i in idx]
+
 
 def get_answer_with_knowledge(
         llm, user_input: str, knowledge_rows: list[dict], max_chunks: int = 4
@@ -25,144 +226,69 @@ def get_answer_with_knowledge(
     if not knowledge_rows:
         return "관련된 지식이 없어 답변할 수 없습니다."
 
-    # 1. similarity 낮은 순으로 정렬 후 상위 max_chunks 선택
-    top_chunks = sorted(knowledge_rows, key=lambda x: x["similarity"])[:max_chunks]
+    # 1. similarity 낮은 순으로 상위 max_chunks 선택(전체 정렬 없이 부분 선택)
+    top_chunks = _smallest_by_similarity(knowledge_rows, max_chunks)
     knowledge_texts = "\n\n".join([x["chunk_text"] for x in top_chunks])
-    print("가공된 데이터:", knowledge_texts)
-
-    # ChatPromptTemplate 사용
-    prompt = ChatPromptTemplate.from_messages([
-        (
-            "system",
-            """당신은 가람포스텍 RAG 시스템의 응답자입니다.
-            아래는 검색된 지식베이스 내용입니다:
-
-            {knowledge_texts}
-
-            규칙:
-            1. 제공된 지식만 사용하여 답변할 것. 질문 문장을 그대로 반복하지 말 것.
-            2. 원문의 핵심 구절(사훈, 표어, 원칙 등)은 반드시 그대로 포함.
-            3. 요약은 허용하되 핵심 구절은 삭제·변형하지 말 것.
-            4. 답변은 번호 목록 또는 불릿포인트로 구조화해 깔끔하게 출력.
-            5. '원문 인용' 같은 라벨은 출력하지 말 것.
-            6. 최대 10줄 이내로 유지.""",
-        ),
-        ("human", "{user_input}"),
-    ])
-
-    chain = prompt | llm
+
+    chain = _RAG_PROMPT | llm
     response = chain.invoke({
         "user_input": user_input,
         "knowledge_texts": knowledge_texts
     })
 
     text_output = response.content
-    print("데이터와 함께 요청 결과:", text_output)
     # return JSONResponse(content={"answer": text_output})
     return text_output
 
 
+def _preview_encoder():
+    global _PREVIEW_ENC
+    if _PREVIEW_ENC is None:
+        _PREVIEW_ENC = tiktoken.encoding_for_model("gpt-4o")
+    return _PREVIEW_ENC
+
+
 def pdf_preview_prompt(file_path: str) -> dict:
-    loader = PyPDFLoader(file_path)
-    documents = loader.load()
-    # 앞 페이지 텍스트를 합치기
-    full_text = "\n".join([doc.page_content for doc in documents])
-    short_text = full_text[:3000]  # 앞 3000자 정도만 LLM에 전달
-
-    prompt = PromptTemplate(
-        input_variables=["input_text"],
-        template="""
-                  "{input_text}"
-                  위 내용을 요약해서 아래 JSON 형식으로만 답변하세요:
-                  {{
-                      "tags": ["...","...","...","..."],
-                      "preview": "...",
-                  }}
-                  """
-    )
+    from langchain_community.document_loaders import PyPDFLoader
+
+    enc = _preview_encoder()
+    # 앞 페이지부터 필요한 만큼만 읽기(토큰 예산을 넘기면 나머지 페이지는 파싱하지 않음)
+    buf, tokens = [], 0
+    for doc in PyPDFLoader(file_path).lazy_load():
+        buf.append(doc.page_content)
+        tokens += len(enc.encode_ordinary(doc.page_content))
+        if tokens >= PREVIEW_MAX_TOKENS:
+            break
+    return pdf_text_preview_prompt("\n".join(buf))
+
+
+def pdf_text_preview_prompt(text: str) -> dict:
+    """이미 추출한 PDF 본문으로 프리뷰 생성(업로드 파이프라인에서 PDF를 다시 파싱하지 않도록)"""
+    enc = _preview_encoder()
+    # 문서 전체를 인코딩하지 않도록 토큰 예산만큼(토큰당 ~4자)만 잘라서 인코딩
+    # encode_ordinary: 본문에 <|endoftext|> 같은 특수 토큰 문자열이 있어도 예외 없이 일반 텍스트로 처리
+    head = (text or "")[: PREVIEW_MAX_TOKENS * 4]
+    short_text = enc.decode(enc.encode_ordinary(head)[:PREVIEW_MAX_TOKENS])
 
-    chain = prompt | llm
-    response = chain.invoke({"input_text": short_text})
-    text_output = response.content
     try:
-        text_output = text_output.replace("```json", "").replace("```", "").strip()
-        text_output = json.loads(text_output)
-        return text_output
-    except json.JSONDecodeError:
+        # 같은/거의 같은 문서 재업로드면 이전 결과 재사용
+        return _invoke_json("pdf_preview", {"input_text": short_text}, short_text)
+    except OutputParserException:
         # JSON이 아닐 경우 fallback 처리
         return {"tags": "", "preview": "text_output"}
 
 
 def preview_prompt(input: str):
-    prompt = PromptTemplate(
-        input_variables=["input"],
-        template="""
-        다음은 사용자가 보낸 요청입니다:
-        "{input}"
-        위 내용을 요약해서 아래 JSON 형식으로만 답변하세요:
-        {{
-            "title": "...",
-            "preview": "..."
-        }}
-        """
-    )
-
-    chain = prompt | llm
-    response = chain.invoke({"input": input})
-    # return response
-    # text_output = response["text"] # 구버전 코드
-    text_output = response.content
-
     try:
-        text_output = text_output.replace("```json", "").replace("```", "").strip()
-        text_output = json.loads(text_output)
-        return text_output
-    except json.JSONDecodeError:
+        return _invoke_json("preview", {"input": input}, input)
+    except OutputParserException as e:
         # JSON이 아닐 경우 fallback 처리
-        return {"title": None, "preview": text_output}
+        return {"title": None, "preview": getattr(e, "llm_output", None)}
 
 
 def user_input_intent(input: str):
-    prompt = PromptTemplate(
-        input_variables=["input"],
-        template="""
-        당신은 AI 모델 추천 어드바이저입니다. 
-        사용자의 메시지를 분석하여 적절한 LLM 모델을 추천하세요. 
-
-        분석 기준:
-        - 언어 (한국어 / 영어 / 혼합)
-        - 도메인 (일상, 금융, 법률, 의료, 학술 등)
-        - 복잡도 (낮음 / 중간 / 높음)
-        - 정확도 중요도 (낮음 / 중간 / 높음)
-        - 창의성 필요성 (낮음 / 중간 / 높음)
-        - 긴급성 (즉시 응답 / 고품질 우선)
-
-        입력 메시지:
-        "{input}"
-
-        출력은 반드시 아래 JSON 형식으로만 답변하세요:
-        {{
-            "analysis": {{
-                "language": "...",
-                "domain": "...",
-                "complexity": "...",
-                "accuracy_importance": "...",
-                "creativity_need": "...",
-                "urgency": "..."
-            }},
-            "recommended_model": "..."
-        }}
-        """
-    )
-    chain = prompt | llm
-    response = chain.invoke({"input": input})
-    text_output = response.content  # ✅ 모델의 답변 텍스트
-    print(text_output)
-
     try:
-        text_output = text_output.replace("```json", "").replace("```", "").strip()
-        text_output = json.loads(text_output)
-        return text_output
-    except json.JSONDecodeError:
+        return _invoke_json("intent", {"input": input}, input)
+    except OutputParserException:
         # JSON이 아닐 경우 fallback 처리
         return {"analysis": None, "recommended_model": DEFAULT_CHAT_MODEL}
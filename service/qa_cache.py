@@ -0,0 +1,138 @@
+# service/qa_cache.py
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+
+from core import config
+from schemas.llm import QAResponse
+
+# (정규화된 질문 벡터, 응답, 저장 시각)
+_Entry = Tuple[np.ndarray, QAResponse, float]
+
+
+def _normalize(vector: Any) -> Optional[np.ndarray]:
+    if vector is None:
+        return None
+    v = np.asarray(vector, dtype=np.float32).ravel()
+    norm = float(np.linalg.norm(v))
+    if v.size == 0 or norm == 0.0:
+        return None
+    return v / norm
+
+
+class SemanticQACache:
+    """
+    _run_qa 응답 시맨틱 캐시.
+    - 버킷 키: (knowledge_id, top_k, style, few_shot_profile, policy_flags) → 같은 조건의 질문끼리만 비교
+    - 버킷 안에서는 질문 임베딩 코사인 유사도 최댓값이 threshold 이상이면 hit
+    - 전체 엔트리 수 max_entries로 제한(LRU 버킷의 가장 오래된 엔트리부터 제거), ttl 지난 엔트리는 조회 시 정리
+    """
+
+    def __init__(self, *, max_entries: int, ttl_seconds: float, threshold: float) -> None:
+        self.max_entries = max(1, int(max_entries))
+        self.ttl_seconds = float(ttl_seconds)
+        self.threshold = float(threshold)
+
+        self._buckets: "OrderedDict[Hashable, List[_Entry]]" = OrderedDict()
+        self._matrix: Dict[Hashable, np.ndarray] = {}
+        self._size = 0
+        self._lock = threading.RLock()
+
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(
+        *,
+        knowledge_id: Optional[int],
+        top_k: int,
+        style: Optional[str],
+        few_shot_profile: Optional[str],
+        policy_flags: Optional[dict],
+    ) -> Hashable:
+        return (knowledge_id, top_k, style, few_shot_profile, frozenset((policy_flags or {}).items()))
+
+    def get(self, key: Hashable, vector: Any) -> Optional[QAResponse]:
+        q = _normalize(vector)
+        with self._lock:
+            if q is not None:
+                self._expire(key, time.monotonic())
+                entries = self._buckets.get(key)
+                if entries:
+                    sims = self._stacked(key) @ q
+                    i = int(np.argmax(sims))
+                    if float(sims[i]) >= self.threshold:
+                        self._buckets.move_to_end(key)
+                        self.hits += 1
+                        resp = entries[i][1]
+                        # 호출측에서 status 보정 등으로 수정해도 캐시 원본은 유지
+                        return resp.model_copy(deep=True)
+            self.misses += 1
+            return None
+
+    def put(self, key: Hashable, vector: Any, resp: QAResponse) -> None:
+        q = _normalize(vector)
+        if q is None:
+            return
+        with self._lock:
+            self._buckets.setdefault(key, []).append((q, resp.model_copy(deep=True), time.monotonic()))
+            self._buckets.move_to_end(key)
+            self._matrix.pop(key, None)
+            self._size += 1
+
+            while self._size > self.max_entries and self._buckets:
+                lru_key, lru_entries = next(iter(self._buckets.items()))
+                lru_entries.pop(0)
+                self._matrix.pop(lru_key, None)
+                self._size -= 1
+                if not lru_entries:
+                    del self._buckets[lru_key]
+
+    def clear(self) -> None:
+        """지식(문서/청크)이 바뀌어 이전 응답의 근거가 달라졌을 때 전체 무효화"""
+        with self._lock:
+            self._buckets.clear()
+            self._matrix.clear()
+            self._size = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": self._size,
+                "buckets": len(self._buckets),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    def _stacked(self, key: Hashable) -> np.ndarray:
+        m = self._matrix.get(key)
+        if m is None:
+            m = np.stack([e[0] for e in self._buckets[key]])
+            self._matrix[key] = m
+        return m
+
+    def _expire(self, key: Hashable, now: float) -> None:
+        entries = self._buckets.get(key)
+        if not entries:
+            return
+        alive = [e for e in entries if now - e[2] < self.ttl_seconds]
+        if len(alive) == len(entries):
+            return
+        self._size -= len(entries) - len(alive)
+        self._matrix.pop(key, None)
+        if alive:
+            self._buckets[key] = alive
+        else:
+            del self._buckets[key]
+
+
+qa_cache = SemanticQACache(
+    max_entries=config.QA_CACHE_MAX_ENTRIES,
+    ttl_seconds=config.QA_CACHE_TTL_SECONDS,
+    threshold=config.QA_CACHE_SIM_THRESHOLD,
+)
@@ -1,34 +1,97 @@
 # service/stt.py
 from __future__ import annotations
 
+import asyncio
+import hashlib
+import inspect
+import io
+import itertools
+import logging
 import os
+import shutil
+import struct
 import subprocess
 import tempfile
-import wave
-from typing import Optional
+import threading
+import time
+from functools import lru_cache, wraps
+from typing import Any, Callable, Optional
 
-import requests
+from core import config
+from service.http_clients import http_session, openai_async_http_client, openai_http_client
 
+log = logging.getLogger(__name__)
 
-def ensure_wav_16k_mono(data: bytes, content_type: str) -> bytes:
+_OPENAI_STT_MODEL = "gpt-4o-mini-transcribe"
+
+
+# 임시 파일 fallback 경로: tmpfs(/dev/shm)가 쓰기 가능하면 디스크 I/O 없이 메모리에 둠
+_TMPDIR = "/dev/shm" if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK) else None
+
+
+@lru_cache(maxsize=None)
+def _bin_path(name: str) -> str:
+    # ffmpeg/ffprobe 절대경로를 한 번만 찾아 재사용(매 호출 PATH 탐색 생략). 못 찾으면 이름 그대로
+    return shutil.which(name) or name
+
+
+def _fix_wav_sizes(buf: bytes) -> bytes:
     """
-    입력 오디오(bytes)를 ffmpeg로 wav(16kHz/mono)로 변환해서 bytes로 반환.
-    ffmpeg 미설치/실패 시 RuntimeError.
+    ffmpeg가 pipe로 wav를 쓰면 seek을 못 해서 RIFF/data 크기 필드가 비어 있음 → 실제 길이로 보정.
     """
+    if len(buf) < 12 or buf[:4] != b"RIFF" or buf[8:12] != b"WAVE":
+        return buf
+    out = bytearray(buf)
+    struct.pack_into("<I", out, 4, len(out) - 8)
+    off = 12
+    while off + 8 <= len(out):
+        chunk_id = bytes(out[off:off + 4])
+        if chunk_id == b"data":
+            struct.pack_into("<I", out, off + 4, len(out) - off - 8)
+            break
+        size = struct.unpack_from("<I", out, off + 4)[0]
+        off += 8 + size + (size & 1)
+    return bytes(out)
+
+
+def _ffmpeg_wav_16k_mono_pipe(data: bytes) -> bytes:
+    # stdin → stdout 파이프 변환(임시 파일 없음)
+    cmd = [
+        _bin_path("ffmpeg"),
+        "-nostdin",
+        "-loglevel",
+        "error",
+        "-i",
+        "pipe:0",
+        "-ac",
+        "1",
+        "-ar",
+        "16000",
+        "-f",
+        "wav",
+        "pipe:1",
+    ]
+    result = subprocess.run(cmd, input=data, capture_output=True, timeout=15, check=False)
+    if result.returncode != 0 or not result.stdout:
+        return b""
+    return _fix_wav_sizes(result.stdout)
+
+
+def _ffmpeg_wav_16k_mono_file(data: bytes) -> bytes:
+    # seek이 필요한 컨테이너(moov가 뒤에 있는 m4a/mp4 등)용 임시 파일 경로
     in_name: Optional[str] = None
     out_name: Optional[str] = None
     try:
-        with tempfile.NamedTemporaryFile(delete=False) as f_in:
+        with tempfile.NamedTemporaryFile(delete=False, dir=_TMPDIR) as f_in:
             in_name = f_in.name
             f_in.write(data)
             f_in.flush()
 
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as f_out:
+        with tempfile.NamedTemporaryFile(delete=False, suffix=".wav", dir=_TMPDIR) as f_out:
             out_name = f_out.name
 
-        # 항상 변환(입력 포맷 다양성 대응)
         cmd = [
-            "ffmpeg",
+            _bin_path("ffmpeg"),
             "-y",
             "-i",
             in_name,
@@ -42,12 +105,8 @@ def ensure_wav_16k_mono(data: bytes, content_type: str) -> bytes:
         ]
         subprocess.run(cmd, capture_output=True, text=True, timeout=15, check=False)
 
-        out = open(out_name, "rb").read()
-        if not out:
-            raise RuntimeError("ffmpeg produced empty output")
-        return out
-    except Exception as e:
-        raise RuntimeError(f"audio convert failed: {e}") from e
+        with open(out_name, "rb") as f:
+            return f.read()
     finally:
         for p in (in_name, out_name):
             if p:
@@ -57,87 +116,282 @@ def ensure_wav_16k_mono(data: bytes, content_type: str) -> bytes:
                     pass
 
 
+def _is_wav_16k_mono_pcm16(data: bytes) -> bool:
+    """RIFF fmt 청크만 보고 이미 16kHz/mono/PCM16 wav인지 판정"""
+    if len(data) < 12 or data[:4] != b"RIFF" or data[8:12] != b"WAVE":
+        return False
+    off = 12
+    while off + 8 <= len(data):
+        tag, size = struct.unpack_from("<4sI", data, off)
+        if tag == b"fmt ":
+            if size < 16 or off + 24 > len(data):
+                return False
+            fmt, channels, rate, _, _, bits = struct.unpack_from("<HHIIHH", data, off + 8)
+            return fmt == 1 and channels == 1 and rate == 16000 and bits == 16
+        off += 8 + size + (size & 1)
+    return False
+
+
+def ensure_wav_16k_mono(data: bytes, content_type: str) -> bytes:
+    """
+    입력 오디오(bytes)를 ffmpeg로 wav(16kHz/mono)로 변환해서 bytes로 반환.
+    이미 16kHz/mono/PCM16 wav면 변환 없이 그대로 반환.
+    기본은 stdin/stdout 파이프, 파이프로 못 읽는 컨테이너만 임시 파일로 재시도.
+    ffmpeg 미설치/실패 시 RuntimeError.
+    """
+    if _is_wav_16k_mono_pcm16(data):
+        return data
+    try:
+        out = _ffmpeg_wav_16k_mono_pipe(data) or _ffmpeg_wav_16k_mono_file(data)
+        if not out:
+            raise RuntimeError("ffmpeg produced empty output")
+        return out
+    except Exception as e:
+        raise RuntimeError(f"audio convert failed: {e}") from e
+
+
 def wav_duration_seconds(wav_bytes: bytes) -> float:
     """
-    wav header 기반 길이 추출. 실패 시 0.
+    wav header(RIFF) 직접 파싱으로 길이 추출. 실패 시 0.
+    data 크기 필드가 비어 있으면(pipe 출력) 남은 바이트 수로 계산.
     """
     try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as f:
-            name = f.name
-            f.write(wav_bytes)
-            f.flush()
-
-        with wave.open(name, "rb") as wf:
-            frames = wf.getnframes()
-            rate = wf.getframerate()
-            if rate <= 0:
-                return 0.0
-            return float(frames) / float(rate)
+        data = wav_bytes
+        if len(data) < 12 or data[:4] != b"RIFF" or data[8:12] != b"WAVE":
+            return 0.0
+        block_align = 0
+        rate = 0
+        off = 12
+        while off + 8 <= len(data):
+            tag, size = struct.unpack_from("<4sI", data, off)
+            body = off + 8
+            if tag == b"fmt ":
+                _, _, rate, _, block_align = struct.unpack_from("<HHIIH", data, body)
+            elif tag == b"data":
+                if rate <= 0 or block_align <= 0:
+                    return 0.0
+                size = min(size, len(data) - body)
+                return float(size // block_align) / float(rate)
+            off = body + size + (size & 1)
+        return 0.0
     except Exception:
         return 0.0
-    finally:
-        try:
-            os.remove(name)
-        except Exception:
-            pass
 
 
 def probe_duration_seconds(data: bytes) -> float:
     """
-    ffprobe로 길이 추출(비-wav fallback). 실패 시 0.
+    ffprobe로 길이 추출(비-wav fallback). 입력은 stdin(pipe:0)으로 전달. 실패 시 0.
+    호출측(stt 비용 기록)은 변환된 wav의 wav_duration_seconds를 먼저 쓰므로 여기는 보조 경로.
     """
-    tmp_name: Optional[str] = None
     try:
-        with tempfile.NamedTemporaryFile(delete=False) as tmp:
-            tmp_name = tmp.name
-            tmp.write(data)
-            tmp.flush()
-
         result = subprocess.run(
             [
-                "ffprobe",
+                _bin_path("ffprobe"),
                 "-v",
                 "error",
                 "-show_entries",
                 "format=duration",
                 "-of",
                 "default=noprint_wrappers=1:nokey=1",
-                tmp_name,
+                "-i",
+                "pipe:0",
             ],
+            input=data,
             capture_output=True,
-            text=True,
             timeout=5,
             check=False,
         )
-        secs = float((result.stdout or "").strip() or "0")
+        secs = float((result.stdout or b"").decode().strip() or "0")
         return max(0.0, secs)
     except Exception:
+        # 파이프 입력에서 "N/A"가 나오는 컨테이너 포함
         return 0.0
+
+
+# 쓰기 N회마다 한 번 디렉터리를 훑어 만료/초과분 삭제
+_STT_CACHE_PRUNE_EVERY = 200
+_STT_CACHE_WRITES = itertools.count(1)
+_STT_CACHE_PRUNE_LOCK = threading.Lock()
+
+
+def _stt_cache_path(wav: bytes, lang: str, provider: str, model: str) -> Optional[str]:
+    base = config.STT_CACHE_DIR
+    if not base:
+        return None
+    key = f"{hashlib.sha256(wav).hexdigest()}-{lang[:2]}-{provider}-{model}"
+    return os.path.join(base, key[:2], key)
+
+
+def _stt_cache_read(path: str) -> Optional[str]:
+    try:
+        if time.time() - os.path.getmtime(path) > config.STT_CACHE_TTL_SECONDS:
+            os.remove(path)
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def _stt_cache_prune() -> None:
+    """TTL 지난 파일 삭제 + 상한(STT_CACHE_MAX_FILES) 초과 시 오래된 것부터 삭제"""
+    base = config.STT_CACHE_DIR
+    if not base or not _STT_CACHE_PRUNE_LOCK.acquire(blocking=False):
+        return
+    try:
+        now = time.time()
+        alive: list[tuple[float, str]] = []
+        for root, _dirs, files in os.walk(base):
+            for name in files:
+                p = os.path.join(root, name)
+                try:
+                    mtime = os.path.getmtime(p)
+                    if now - mtime > config.STT_CACHE_TTL_SECONDS:
+                        os.remove(p)
+                    else:
+                        alive.append((mtime, p))
+                except OSError:
+                    continue
+        overflow = len(alive) - config.STT_CACHE_MAX_FILES
+        if overflow > 0:
+            alive.sort()
+            for _mtime, p in alive[:overflow]:
+                try:
+                    os.remove(p)
+                except OSError:
+                    pass
+    except Exception as e:
+        log.warning("stt cache prune failed: %s", e)
+    finally:
+        _STT_CACHE_PRUNE_LOCK.release()
+
+
+def _stt_cache_write(path: str, text: str) -> None:
+    # 임시 파일에 쓰고 os.replace → 동시 요청이 반쯤 쓰인 파일을 읽지 않음
+    tmp_name: Optional[str] = None
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+            "w", encoding="utf-8", dir=os.path.dirname(path), delete=False
+        ) as f:
+            tmp_name = f.name
+            f.write(text)
+        os.replace(tmp_name, path)
+        tmp_name = None
+    except OSError:
+        pass
     finally:
         if tmp_name:
             try:
                 os.remove(tmp_name)
             except Exception:
                 pass
+    if next(_STT_CACHE_WRITES) % _STT_CACHE_PRUNE_EVERY == 0:
+        _stt_cache_prune()
+
 
+def _stt_cached(provider: str, model: str):
+    """
+    같은 오디오(바이트 동일) + 언어 + provider + 모델이면 원격 STT를 다시 부르지 않음(재업로드/재시도).
+    캐시 읽기/쓰기 실패는 무시하고 원래 호출로 진행. STT_CACHE_DIR이 비어 있으면 그대로 통과.
+    on_miss: 원격 STT를 실제로 부르기 직전에만 호출(과금 기록용, 캐시 히트면 호출 안 됨)
+    """
+
+    def deco(fn: Callable[[bytes, str], Any]) -> Callable[..., Any]:
+        if inspect.iscoroutinefunction(fn):
+
+            @wraps(fn)
+            async def async_wrapper(
+                wav_16k_mono: bytes, lang: str, *, on_miss: Optional[Callable[[], Any]] = None
+            ) -> str:
+                path = None
+                if config.STT_CACHE_DIR:
+                    # 해시/파일 I/O는 이벤트 루프를 막지 않도록 스레드에서
+                    path = await asyncio.to_thread(_stt_cache_path, wav_16k_mono, lang, provider, model)
+                if path:
+                    hit = await asyncio.to_thread(_stt_cache_read, path)
+                    if hit is not None:
+                        return hit
+                if on_miss is not None:
+                    on_miss()
+                text = await fn(wav_16k_mono, lang)
+                if path and text:
+                    await asyncio.to_thread(_stt_cache_write, path, text)
+                return text
+
+            return async_wrapper
+
+        @wraps(fn)
+        def wrapper(wav_16k_mono: bytes, lang: str, *, on_miss: Optional[Callable[[], Any]] = None) -> str:
+            path = _stt_cache_path(wav_16k_mono, lang, provider, model)
+            if path:
+                hit = _stt_cache_read(path)
+                if hit is not None:
+                    return hit
+            if on_miss is not None:
+                on_miss()
+            text = fn(wav_16k_mono, lang)
+            if path and text:
+                _stt_cache_write(path, text)
+            return text
+
+        return wrapper
+
+    return deco
+
+
+@lru_cache(maxsize=1)
+def _openai_client(api_key: str):
+    # 호출마다 클라이언트를 만들지 않고 재사용(공용 httpx 풀 → keep-alive 커넥션 유지)
+    from openai import OpenAI
 
+    return OpenAI(api_key=api_key, http_client=openai_http_client)
+
+
+@_stt_cached("openai", _OPENAI_STT_MODEL)
 def openai_transcribe(wav_16k_mono: bytes, lang: str) -> str:
     """
     OpenAI gpt-4o-mini-transcribe 모델로 STT 호출.
     lang: "ko-KR" → "ko" 형태로 변환하여 전달.
     """
-    import io
-    from openai import OpenAI
-
     api_key = os.getenv("OPENAI_API")
     if not api_key:
         raise RuntimeError("OPENAI_API env missing")
 
-    client = OpenAI(api_key=api_key)
+    client = _openai_client(api_key)
     buf = io.BytesIO(wav_16k_mono)
     buf.name = "audio.wav"
     resp = client.audio.transcriptions.create(
-        model="gpt-4o-mini-transcribe",
+        model=_OPENAI_STT_MODEL,
+        file=buf,
+        language=lang[:2],  # "ko-KR" → "ko"
+        response_format="json",
+    )
+    return resp.text.strip()
+
+
+@lru_cache(maxsize=1)
+def _openai_async_client(api_key: str):
+    # 이벤트 루프에서 바로 await 하는 경로용(스레드 점유 없이 여러 STT 요청을 동시에 대기)
+    from openai import AsyncOpenAI
+
+    return AsyncOpenAI(api_key=api_key, http_client=openai_async_http_client)
+
+
+@_stt_cached("openai", _OPENAI_STT_MODEL)
+async def openai_transcribe_async(wav_16k_mono: bytes, lang: str) -> str:
+    """
+    openai_transcribe의 async 버전(캐시 키 공유).
+    """
+    api_key = os.getenv("OPENAI_API")
+    if not api_key:
+        raise RuntimeError("OPENAI_API env missing")
+
+    client = _openai_async_client(api_key)
+    buf = io.BytesIO(wav_16k_mono)
+    buf.name = "audio.wav"
+    resp = await client.audio.transcriptions.create(
+        model=_OPENAI_STT_MODEL,
         file=buf,
         language=lang[:2],  # "ko-KR" → "ko"
         response_format="json",
@@ -145,6 +399,7 @@ def openai_transcribe(wav_16k_mono: bytes, lang: str) -> str:
     return resp.text.strip()
 
 
+@_stt_cached("clova", "clova")
 def clova_transcribe(wav_16k_mono: bytes, lang: str) -> str:
     """
     CLOVA STT 호출. 환경변수:
@@ -169,7 +424,7 @@ def clova_transcribe(wav_16k_mono: bytes, lang: str) -> str:
     if "lang=" not in url:
         params["lang"] = lang
 
-    r = requests.post(url, headers=headers, params=params, data=wav_16k_mono, timeout=30)
+    r = http_session.post(url, headers=headers, params=params, data=wav_16k_mono, timeout=30)
     if r.status_code >= 400:
         raise RuntimeError(f"clova stt http {r.status_code}: {r.text}")
 
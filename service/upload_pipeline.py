@@ -1,13 +1,19 @@
 # services/upload_pipeline.py
 import os
 import re
-import shutil
+import hashlib
 import logging
+import multiprocessing
+import threading
+from functools import lru_cache
+from itertools import islice
 from uuid import uuid4
-from typing import List, Optional, Tuple
-from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime, timezone
 
+import numpy as np
 from fastapi import UploadFile
 from sqlalchemy.orm import Session
 
@@ -15,33 +21,23 @@ from models.knowledge import Knowledge
 import crud.knowledge as crud
 import crud.api_cost as cost
 import core.config as config
+from service.qa_cache import qa_cache
 from core.pricing import (
     tokens_for_texts,
     normalize_usage_embedding,
     estimate_embedding_cost_usd,
 )
 
-from langchain_community.document_loaders import PyMuPDFLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-
 log = logging.getLogger("api_cost")
 
 DEBUG_RAG_URL = os.getenv("DEBUG_RAG_URL") == "1"
 
-# 임베딩: 배치가 있으면 우선 사용, 없으면 단건 + 스레드풀
-try:
-    from langchain_service.embedding.get_vector import text_to_vector, text_list_to_vectors  # type: ignore
-
-    _HAS_BATCH = True
-except Exception:
-    from langchain_service.embedding.get_vector import text_to_vector  # type: ignore
-
-    _HAS_BATCH = False
-
 # 프리뷰 LLM 사용 여부(기본 비활성)
 _USE_LLM_PREVIEW = getattr(config, "USE_LLM_PREVIEW", False)
-if _USE_LLM_PREVIEW:
-    from service.prompt import pdf_preview_prompt  # type: ignore
+
+# 무거운 의존성(PyMuPDF/langchain 스플리터/임베딩)은 첫 업로드 때 import 후 캐시
+_SPLITTER_CLS = None
+_EMBED_FNS: Optional[Tuple[Callable, Optional[Callable]]] = None
 
 # =========================================================
 # parent-child chunking configs
@@ -51,6 +47,23 @@ _USE_PARENT_CHILD_CHUNKING = getattr(config, "USE_PARENT_CHILD_CHUNKING", True)
 _CHILD_CHUNK_SIZE = getattr(config, "CHILD_CHUNK_SIZE", 900)
 _CHILD_CHUNK_OVERLAP = getattr(config, "CHILD_CHUNK_OVERLAP", 150)
 _PARENT_SUMMARY_MAX_CHARS = getattr(config, "PARENT_SUMMARY_MAX_CHARS", 220)
+_CHILD_MIN_CHUNK_TOKENS = getattr(config, "CHILD_MIN_CHUNK_TOKENS", min(100, _CHILD_CHUNK_SIZE // 9))
+
+_EMBED_MIN_CHARS = int(getattr(config, "EMBED_MIN_CHARS", 20))
+_EMBED_MIN_ALPHA_RATIO = float(getattr(config, "EMBED_MIN_ALPHA_RATIO", 0.3))
+_PAGE_MARKER_RE = re.compile(r"(?:page|페이지)?\s*\d+(?:\s*(?:/|of)\s*\d+)?", re.IGNORECASE)
+
+# 추출 텍스트 정규화/헤딩 판별용 패턴(줄/문서마다 호출되므로 모듈 로드 시 한 번만 컴파일)
+_WS_RE = re.compile(r"\s+")
+_HREF_RE = re.compile(r'href="([^"]*)"', re.IGNORECASE | re.DOTALL)
+_URL_BREAK_RE = re.compile(r"(https?://[^\s<>\"]+)\s*\n\s*([^\s<>\"]+)", re.IGNORECASE)
+_BOARD_CODE_RE = re.compile(r"(board_code=)rw(?!dboard)[^\s&]+")
+_IDX_DOT_RE = re.compile(r"idx=(?P<digits>\d{6,9})(?P<tail>\.\s*)")
+_IDX_NODOT_RE = re.compile(r"idx=(?P<digits>\d{6,9})(?P<ws>\s*)(?=[가-힣A-Za-z])")
+_NUM_HEADING_RE = re.compile(r"^(\(?\d+(\.\d+)*\)?[\.\)])\s+\S+")
+_ACRONYM_RE = re.compile(r"\b[A-Z]{2,}\b")
+# str.splitlines()와 같은 줄 구분자 기준의 한 줄(빈 줄 제외)
+_LINE_RE = re.compile(r"[^\n\r\v\f\x1c\x1d\x1e\x85\u2028\u2029]+")
 
 _EMBED_INCLUDE_PARENT_TITLE = getattr(config, "EMBED_INCLUDE_PARENT_TITLE", True)
 _EMBED_INCLUDE_ALIASES = getattr(config, "EMBED_INCLUDE_ALIASES", True)
@@ -66,13 +79,37 @@ _CHILD_PREFIX = "[CHILD]"
 
 _GARAM_READ_MARK = "m.garampos.co.kr/bbs_shop/read.htm"
 
+# PDF 파싱 프로세스 풀(최초 업로드 시 생성)
+_PARSE_WORKERS = int(getattr(config, "UPLOAD_PARSE_WORKERS", 2) or 0)
+_DEDUP_BY_HASH = getattr(config, "UPLOAD_DEDUP_BY_HASH", True)
+_HASH_BLOCK = 1024 * 1024
+_PARSE_POOL: Optional[ProcessPoolExecutor] = None
+_PARSE_POOL_LOCK = threading.Lock()
+_PARSE_SPLIT_MIN_PAGES = int(getattr(config, "UPLOAD_PARSE_SPLIT_MIN_PAGES", 64))
+# 섹션이 이 개수 이상이면 자식 청크 분할도 파싱 풀에 나눠 맡김
+_SPLIT_PARALLEL_MIN_SECTIONS = int(getattr(config, "UPLOAD_SPLIT_PARALLEL_MIN_SECTIONS", 16))
+
+# 청크/임베딩을 DB 저장과 겹쳐 돌리는 스레드 풀
+_EMBED_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="upload-embed")
+
+# 임베딩 배치 요청을 동시에 보내는 풀(_EMBED_POOL 작업 안에서 submit하므로 풀을 분리해 교착 방지)
+# 프로세스 전체 공용이라 동시 업로드가 몰려도 임베딩 API 동시 요청 수는 EMBED_MAX_CONCURRENCY로 제한됨
+_EMBED_BATCH_POOL = ThreadPoolExecutor(
+    max_workers=max(1, int(getattr(config, "EMBED_MAX_CONCURRENCY", 4))),
+    thread_name_prefix="upload-embed-batch",
+)
+
 
 # =========================================================
 # helpers
 # =========================================================
+_TOK_MODEL = getattr(config, "DEFAULT_EMBEDDING_MODEL", "text-embedding-3-small")
+
+
+@lru_cache(maxsize=8192)
 def _tok_len(s: str) -> int:
-    model = getattr(config, "DEFAULT_EMBEDDING_MODEL", "text-embedding-3-small")
-    return tokens_for_texts(model, [s])
+    # 스플리터가 같은 조각/병합 후보 길이를 반복해서 물어보므로 메모이즈
+    return tokens_for_texts(_TOK_MODEL, [s])
 
 
 def _snip(s: str, n: int = 420) -> str:
@@ -90,7 +127,7 @@ def _normalize_garampos_pdf_text(text: str) -> str:
         return t
 
     # board_code=rwdboard가 아닌 이상한 값으로 깨졌을 때만 교정
-    t = re.sub(r"(board_code=)rw(?!dboard)[^\s&]+", r"\1rwdboard", t)
+    t = _BOARD_CODE_RE.sub(r"\1rwdboard", t)
 
     def _split_idx_and_no(digits: str) -> tuple[str, str]:
         """
@@ -113,7 +150,7 @@ def _normalize_garampos_pdf_text(text: str) -> str:
         return f"idx={idx}\n{entry}{tail}"
 
     # 케이스1) idx=32068134. 처럼 dot이 바로 오는 경우
-    t = re.sub(r"idx=(?P<digits>\d{6,9})(?P<tail>\.\s*)", _repl_with_dot, t)
+    t = _IDX_DOT_RE.sub(_repl_with_dot, t)
 
     def _repl_no_dot(m: re.Match) -> str:
         digits = m.group("digits")
@@ -122,7 +159,7 @@ def _normalize_garampos_pdf_text(text: str) -> str:
         return f"idx={idx}\n{entry}{ws}"
 
     # 케이스2) idx=32068134 시트롤... 처럼 dot 없이 바로 제목이 오는 경우
-    t = re.sub(r"idx=(?P<digits>\d{6,9})(?P<ws>\s*)(?=[가-힣A-Za-z])", _repl_no_dot, t)
+    t = _IDX_NODOT_RE.sub(_repl_no_dot, t)
 
     return t
 
@@ -139,22 +176,18 @@ def _normalize_extracted_text(text: str) -> str:
     # href=" ... " 내부의 공백/줄바꿈 제거
     def _fix_href(m: re.Match) -> str:
         url = m.group(1) or ""
-        url = re.sub(r"\s+", "", url)
+        url = _WS_RE.sub("", url)
         return f'href="{url}"'
 
-    t = re.sub(r'href="([^"]*)"', _fix_href, t, flags=re.IGNORECASE | re.DOTALL)
+    t = _HREF_RE.sub(_fix_href, t)
 
     # 일반 URL이 줄바꿈으로 끊긴 경우 이어붙이기 (최대 3회)
-    for _ in range(3):
-        new_t = re.sub(
-            r"(https?://[^\s<>\"]+)\s*\n\s*([^\s<>\"]+)",
-            r"\1\2",
-            t,
-            flags=re.IGNORECASE,
-        )
-        if new_t == t:
-            break
-        t = new_t
+    # URL이 없는 문서는 정규식 스캔 생략, 치환 횟수로 종료 판단(문서 전체 문자열 비교 없음)
+    if "://" in t:
+        for _ in range(3):
+            t, n = _URL_BREAK_RE.subn(r"\1\2", t)
+            if not n:
+                break
 
     # 가람포스텍 리스트 깨짐 복원(가람 URL일 때만 동작)
     t = _normalize_garampos_pdf_text(t)
@@ -189,26 +222,53 @@ def _norm_line(s: str) -> str:
 
 
 def _is_heading(line: str) -> bool:
-    ln = _norm_line(line)
+    return _is_heading_normed(_norm_line(line))
+
+
+def _is_heading_normed(ln: str) -> bool:
+    """_norm_line을 이미 거친 줄용(chunk_parent_child에서 줄마다 정규화를 반복하지 않도록)"""
     if not ln:
         return False
     if ln.startswith("#"):
         return True
-    if re.match(r"^(\(?\d+(\.\d+)*\)?[\.\)])\s+\S+", ln):
+    if _NUM_HEADING_RE.match(ln):
         return True
     if len(ln) <= 50:
-        if sum(ch in ln for ch in ".?!") >= 1:
+        if "." in ln or "?" in ln or "!" in ln:
             return False
         keywords = ("설정", "오류", "방법", "주의", "개요", "원인", "해결", "FAQ", "가이드", "정의", "예시")
         if ln.endswith(keywords):
             return True
-        if re.search(r"\b[A-Z]{2,}\b", ln):
+        # 대문자가 하나도 없는 줄(한글 위주)은 정규식 없이 통과: lower()가 바꾸는 글자가 있어야 [A-Z] 가능
+        if ln.lower() != ln and _ACRONYM_RE.search(ln):
             return True
     return False
 
 
+def _is_embeddable(text: str) -> bool:
+    """
+    임베딩 비용을 쓸 가치가 있는 청크인지 판단.
+    - 공백/쪽번호("Page 3", "3 / 10")만 있는 청크 제외
+    - 너무 짧거나 문자(한글/영문) 비율이 낮은(구분선/숫자표 조각) 청크 제외
+    """
+    t = (text or "").strip()
+    if len(t) < _EMBED_MIN_CHARS:
+        return False
+    if _PAGE_MARKER_RE.fullmatch(t):
+        return False
+    alpha = sum(1 for ch in t if ch.isalpha())
+    return alpha / len(t) >= _EMBED_MIN_ALPHA_RATIO
+
+
 def _make_parent_summary(body: str, max_chars: int) -> str:
-    lines = [_norm_line(x) for x in (body or "").splitlines() if _norm_line(x)]
+    # 앞 3줄만 쓰므로 본문 전체를 정규화하지 않고 3줄 찾으면 중단
+    lines: List[str] = []
+    for x in (body or "").splitlines():
+        ln = _norm_line(x)
+        if ln:
+            lines.append(ln)
+            if len(lines) == 3:
+                break
     if not lines:
         return ""
     head = " ".join(lines[:3]).strip()
@@ -224,20 +284,280 @@ def _alias_map() -> dict:
     return m
 
 
+# 기본 + 설정(EMBED_ALIAS_MAP) 별칭은 import 후 바뀌지 않으므로 한 번만 병합
+_ALIAS_MAP = _alias_map()
+
+
+@lru_cache(maxsize=1024)
+def _alias_tuple(title: str) -> Tuple[str, ...]:
+    # 같은 섹션 제목이 자식 청크 수만큼 반복 조회되므로 제목 단위로 메모이즈(순서 유지 + 중복 제거)
+    return tuple(dict.fromkeys(v for k, v in _ALIAS_MAP.items() if k in title and v not in title))
+
+
 def _aliases_for_title(title: str) -> List[str]:
-    t = title or ""
-    amap = _alias_map()
-    out: List[str] = []
-    for k, v in amap.items():
-        if k in t and v not in t:
-            out.append(v)
-    seen = set()
-    uniq: List[str] = []
-    for x in out:
-        if x not in seen:
-            seen.add(x)
-            uniq.append(x)
-    return uniq
+    return list(_alias_tuple(title or ""))
+
+
+def _merge_small_chunks(body: str, docs: List[Any], max_tokens: int, min_tokens: int) -> List[str]:
+    """
+    분할 결과 중 min_tokens 미만 자투리 청크를 앞 청크에 병합.
+    앞 청크는 보통 max_tokens에 거의 차 있으므로 상한은 max_tokens + min_tokens(자투리 하나만큼)까지 허용.
+    자투리가 임베딩 호출을 낭비하거나 _is_embeddable에서 내용째 버려지는 것을 줄임.
+    병합은 스플리터가 준 start_index로 원문 body[앞 청크 시작:뒤 청크 끝]을 잘라 만들어 overlap이 한 번만 남고 본문은 빠지지 않음.
+    """
+    spans: List[Tuple[int, int]] = []
+    for d in docs:
+        text = d.page_content or ""
+        if not text.strip():
+            continue
+        start = (d.metadata or {}).get("start_index", -1)
+        if start < 0:
+            # 위치를 못 찾은 청크가 있으면 병합 없이 원래 분할 결과 사용
+            return [c for c in ((x.page_content or "").strip() for x in docs) if c]
+        spans.append((start, start + len(text)))
+    if min_tokens <= 0 or len(spans) < 2:
+        return [body[s:e].strip() for s, e in spans]
+
+    limit = max_tokens + min_tokens
+    out: List[Tuple[int, int]] = []
+    for s, e in spans:
+        if out:
+            ps, pe = out[-1]
+            if _tok_len(body[s:e]) < min_tokens or _tok_len(body[ps:pe]) < min_tokens:
+                me = max(pe, e)
+                if _tok_len(body[ps:me]) <= limit:
+                    out[-1] = (ps, me)
+                    continue
+        out.append((s, e))
+    return [body[s:e].strip() for s, e in out]
+
+
+def _text_splitter_cls():
+    global _SPLITTER_CLS
+    if _SPLITTER_CLS is None:
+        from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+        _SPLITTER_CLS = RecursiveCharacterTextSplitter
+    return _SPLITTER_CLS
+
+
+@lru_cache(maxsize=None)
+def _splitter(chunk_size: int, chunk_overlap: int):
+    # 설정값별 스플리터 1개만 만들어 재사용(split_text/create_documents는 인스턴스 상태를 바꾸지 않아 스레드 간 공유 가능)
+    return _text_splitter_cls()(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        length_function=_tok_len,
+        separators=["\n\n", "\n", " ", ""],
+        add_start_index=True,
+    )
+
+
+def _embed_fns() -> Tuple[Callable, Optional[Callable]]:
+    """
+    (text_to_vector, text_list_to_vectors|None)
+    임베딩: 배치가 있으면 우선 사용, 없으면 단건 + 스레드풀
+    """
+    global _EMBED_FNS
+    if _EMBED_FNS is None:
+        from langchain_service.embedding import get_vector
+
+        _EMBED_FNS = (get_vector.text_to_vector, getattr(get_vector, "text_list_to_vectors", None))
+    return _EMBED_FNS
+
+
+def _embed_texts_billed(texts: List[str]) -> Tuple[List[np.ndarray], List[str]]:
+    """
+    입력 순서를 유지한 채 임베딩. 반환: (float32 벡터|None, API로 새로 임베딩된 텍스트 → 비용 집계용)
+    - 디스크 캐시(embedding_cache)에 있는 텍스트는 재사용, 같은 업로드 안 중복 텍스트도 한 번만 요청
+    - 임베딩 실패(None)는 저장 단계에서 빠지므로 비용/캐시에도 넣지 않음
+    """
+    if not texts:
+        return [], []
+    from service import embedding_cache
+
+    model = config.EMBEDDING_MODEL
+    vecs: List[Optional[np.ndarray]] = [None] * len(texts)
+    for i, v in embedding_cache.get_many(model, texts).items():
+        vecs[i] = v
+
+    pending = [t for t, v in zip(texts, vecs) if v is None]
+    misses = list(dict.fromkeys(pending))
+    if len(misses) < len(pending):
+        log.info("embed: %d/%d duplicate texts embedded once", len(pending) - len(misses), len(texts))
+    billed: List[str] = []
+    if misses:
+        fresh = dict(zip(misses, _embed_uncached(misses)))
+        done = [(t, v) for t, v in fresh.items() if v is not None]
+        if len(done) < len(misses):
+            log.warning(
+                "embed: %d/%d chunks failed to embed and will not be stored", len(misses) - len(done), len(misses)
+            )
+        embedding_cache.put_many(model, done)
+        billed = [t for t, _ in done]
+        vecs = [fresh[t] if v is None else v for t, v in zip(texts, vecs)]
+    return vecs, billed
+
+
+def _embed_uncached(texts: List[str]) -> List[np.ndarray]:
+    """
+    배치 함수가 있으면 EMBED_BATCH_SIZE 단위 배치를 _EMBED_BATCH_POOL에서 동시에 요청(분할은 text_list_to_vectors),
+    없으면 단건 + 스레드풀
+    """
+    text_to_vector, text_list_to_vectors = _embed_fns()
+    if text_list_to_vectors is None:
+        return list(_EMBED_BATCH_POOL.map(text_to_vector, texts))
+    return list(text_list_to_vectors(texts, executor=_EMBED_BATCH_POOL))
+
+
+def _disk_fileno(fobj) -> Optional[int]:
+    """
+    업로드 파일이 실제 디스크 파일이면 fd, 메모리(SpooledTemporaryFile rollover 전)면 None.
+    SpooledTemporaryFile.fileno()는 강제로 rollover 하므로 먼저 _rolled를 확인.
+    """
+    if getattr(fobj, "_rolled", True) is False:
+        return None
+    try:
+        return fobj.fileno()
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+def _hash_fd(fd: int, size: int) -> str:
+    """sendfile로 복사한 원본 fd를 pread로 해시(방금 복사해 페이지 캐시에 있음, 파일 오프셋 변경 없음)"""
+    h = hashlib.blake2b(digest_size=32)
+    offset = 0
+    while offset < size:
+        block = os.pread(fd, min(_HASH_BLOCK, size - offset), offset)
+        if not block:
+            break
+        h.update(block)
+        offset += len(block)
+    return h.hexdigest()
+
+
+def _load_pdf_text(file_path: str) -> Tuple[str, int]:
+    """
+    PDF → (페이지 텍스트 합본, 페이지 수)
+    프로세스 풀에서 실행되므로 모듈 최상위 함수로 두고, Document 리스트 대신 문자열만 돌려받음.
+    PyMuPDF로 한 번만 열어 페이지를 순회(로더의 페이지별 Document/메타데이터 생성 없음).
+    """
+    import fitz
+
+    with fitz.open(file_path) as doc:
+        num_pages = doc.page_count
+        raw = "\n".join(t for t in (page.get_text() for page in doc) if t).strip()
+    return raw, num_pages
+
+
+def _pdf_page_count(file_path: str) -> int:
+    import fitz
+
+    with fitz.open(file_path) as doc:
+        return doc.page_count
+
+
+def _load_pdf_pages(file_path: str, start: int, stop: int) -> List[str]:
+    """[start, stop) 범위 페이지 텍스트(빈 페이지 제외). 큰 PDF를 워커 프로세스별로 나눠 파싱할 때 사용"""
+    import fitz
+
+    with fitz.open(file_path) as doc:
+        return [t for t in (doc[i].get_text() for i in range(start, stop)) if t]
+
+
+def _parse_mp_context():
+    # 요청 스레드/스케줄러/HTTP 풀이 돌고 있는 프로세스를 fork하면 자식이 잠긴 락을 물려받아 멈출 수 있음
+    # → forkserver(없는 플랫폼은 spawn)로 깨끗한 프로세스에서 워커 시작(워커 함수는 모두 모듈 최상위)
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return multiprocessing.get_context(method)
+
+
+def _get_parse_pool() -> Optional[ProcessPoolExecutor]:
+    global _PARSE_POOL
+    if _PARSE_WORKERS <= 0:
+        return None
+    pool = _PARSE_POOL
+    if pool is not None:
+        return pool
+    # 동시에 들어온 첫 업로드들이 풀을 각자 만들어 하나를 워커째 새게 하지 않도록 잠금 후 재확인
+    with _PARSE_POOL_LOCK:
+        if _PARSE_POOL is None:
+            _PARSE_POOL = ProcessPoolExecutor(max_workers=_PARSE_WORKERS, mp_context=_parse_mp_context())
+        return _PARSE_POOL
+
+
+def _discard_parse_pool(pool: ProcessPoolExecutor) -> None:
+    """깨진 풀 정리: 아직 전역에 걸려 있으면 떼어내고 남은 워커/관리 스레드 종료"""
+    global _PARSE_POOL
+    with _PARSE_POOL_LOCK:
+        if _PARSE_POOL is pool:
+            _PARSE_POOL = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _parse_pdf_in_pool(pool: ProcessPoolExecutor, file_path: str) -> Tuple[str, int]:
+    num_pages = pool.submit(_pdf_page_count, file_path).result()
+    if _PARSE_WORKERS < 2 or num_pages < _PARSE_SPLIT_MIN_PAGES:
+        return pool.submit(_load_pdf_text, file_path).result()
+
+    # PyMuPDF는 스레드 병렬을 지원하지 않으므로 페이지 범위를 워커 프로세스마다 나눠 파싱
+    step = -(-num_pages // _PARSE_WORKERS)
+    futures = [
+        pool.submit(_load_pdf_pages, file_path, start, min(start + step, num_pages))
+        for start in range(0, num_pages, step)
+    ]
+    texts: List[str] = []
+    for fut in futures:
+        texts.extend(fut.result())
+    return "\n".join(texts).strip(), num_pages
+
+
+def _parse_pdf(file_path: str) -> Tuple[str, int]:
+    """
+    CPU 바운드 PDF 파싱을 워커 프로세스로 넘겨 API 프로세스의 GIL/스레드풀을 붙잡지 않게 함.
+    페이지가 많으면 페이지 범위별로 여러 워커에 나눠 파싱.
+    풀이 없거나 깨졌으면 현재 스레드에서 직접 파싱.
+    """
+    pool = _get_parse_pool()
+    if pool is None:
+        return _load_pdf_text(file_path)
+    try:
+        return _parse_pdf_in_pool(pool, file_path)
+    except BrokenProcessPool:
+        log.warning("pdf parse pool broken; parsing inline")
+        _discard_parse_pool(pool)
+        return _load_pdf_text(file_path)
+
+
+def _split_child_bodies(bodies: List[str]) -> List[List[str]]:
+    """섹션 본문들 → 섹션별 자식 청크 목록. 프로세스 풀에서도 돌 수 있게 모듈 최상위 함수"""
+    splitter = _splitter(_CHILD_CHUNK_SIZE, _CHILD_CHUNK_OVERLAP)
+    return [
+        _merge_small_chunks(body, splitter.create_documents([body]), _CHILD_CHUNK_SIZE, _CHILD_MIN_CHUNK_TOKENS)
+        for body in bodies
+    ]
+
+
+def _split_child_bodies_parallel(bodies: List[str]) -> List[List[str]]:
+    """
+    섹션은 서로 독립이라, 섹션이 많으면 파싱 프로세스 풀 워커별로 연속 구간을 나눠 분할(토큰 길이 계산이 CPU 바운드).
+    풀이 없거나 섹션이 적으면 현재 스레드에서 분할.
+    """
+    pool = _get_parse_pool()
+    if pool is None or _PARSE_WORKERS < 2 or len(bodies) < _SPLIT_PARALLEL_MIN_SECTIONS:
+        return _split_child_bodies(bodies)
+
+    step = -(-len(bodies) // _PARSE_WORKERS)
+    try:
+        futures = [pool.submit(_split_child_bodies, bodies[i:i + step]) for i in range(0, len(bodies), step)]
+        out: List[List[str]] = []
+        for fut in futures:
+            out.extend(fut.result())
+        return out
+    except BrokenProcessPool:
+        log.warning("pdf parse pool broken; splitting inline")
+        _discard_parse_pool(pool)
+        return _split_child_bodies(bodies)
 
 
 def _log_url_stage(stage: str, text: str) -> None:
@@ -274,6 +594,8 @@ class UploadPipeline:
         self.db = db
         self.user_id = user_id
         self.file_path: Optional[str] = None
+        self.file_size: Optional[int] = None
+        self.content_hash: Optional[str] = None
         self.knowledge: Optional[Knowledge] = None
 
     def save_file(self, file: UploadFile) -> str:
@@ -286,18 +608,42 @@ class UploadPipeline:
         fpath = os.path.join(user_dir, fname)
 
         file.file.seek(0)
-        with open(fpath, "wb") as f:
-            shutil.copyfileobj(file.file, f, length=1024 * 1024)
+        src_fd = _disk_fileno(file.file)
+        if src_fd is not None and hasattr(os, "sendfile"):
+            # 디스크로 넘어간 업로드 임시 파일 → 커널 안에서 복사(유저 공간 버퍼 없음)
+            dst_fd = os.open(fpath, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                offset, remaining = 0, os.fstat(src_fd).st_size
+                while remaining > 0:
+                    n = os.sendfile(dst_fd, src_fd, offset, min(remaining, 1 << 24))
+                    if n == 0:
+                        break
+                    offset += n
+                    remaining -= n
+            finally:
+                os.close(dst_fd)
+            size = offset
+            content_hash = _hash_fd(src_fd, size)
+        else:
+            # 쓰는 블록을 그대로 해시에 흘려 넣음(원본을 다시 읽지 않음)
+            h = hashlib.blake2b(digest_size=32)
+            with open(fpath, "wb") as f:
+                while True:
+                    block = file.file.read(_HASH_BLOCK)
+                    if not block:
+                        break
+                    h.update(block)
+                    f.write(block)
+                size = f.tell()
+            content_hash = h.hexdigest()
 
         self.file_path = fpath
+        self.file_size = size  # 쓴 바이트 수를 그대로 기록(create_metadata에서 stat 생략)
+        self.content_hash = content_hash
         return fpath
 
-    def _load_docs(self, file_path: str):
-        return PyMuPDFLoader(file_path).load()
-
     def extract_text(self, file_path: str) -> Tuple[str, int]:
-        docs = self._load_docs(file_path)
-        raw = "\n".join(d.page_content for d in docs if getattr(d, "page_content", "")).strip()
+        raw, num_pages = _parse_pdf(file_path)
 
         _log_url_stage("EXTRACT_RAW", raw)
 
@@ -305,12 +651,15 @@ class UploadPipeline:
 
         _log_url_stage("EXTRACT_NORM", text)
 
-        return text, len(docs)
+        return text, num_pages
 
     def _build_preview(self, text: str, max_chars: int = 400) -> str:
-        if _USE_LLM_PREVIEW and self.file_path:
+        if _USE_LLM_PREVIEW and text:
             try:
-                prev_obj = pdf_preview_prompt(self.file_path)  # type: ignore
+                from service.prompt import pdf_text_preview_prompt
+
+                # extract_text 결과 재사용(PDF 재파싱 없음)
+                prev_obj = pdf_text_preview_prompt(text)
                 if isinstance(prev_obj, dict):
                     p = prev_obj.get("preview", "")
                     if isinstance(p, list):
@@ -319,41 +668,31 @@ class UploadPipeline:
                 return str(prev_obj)[:max_chars]
             except Exception:
                 pass
-        lines = [ln.strip() for ln in (text or "").splitlines() if ln.strip()]
-        return " ".join(lines[:5])[:max_chars]
+        # 앞 5줄만 필요하므로 문서 전체 splitlines 없이 줄을 앞에서부터 순회
+        lines = islice((ln for ln in (m.group().strip() for m in _LINE_RE.finditer(text or "")) if ln), 5)
+        return " ".join(lines)[:max_chars]
 
     def create_metadata(self, file: UploadFile, preview: str) -> Knowledge:
-        file_size = os.path.getsize(self.file_path or "")
+        file_size = self.file_size if self.file_size is not None else os.path.getsize(self.file_path or "")
         data = {
             "original_name": file.filename,
             "type": file.content_type,
             "size": file_size,
             "status": "processing",
             "preview": preview or "",
+            "content_hash": self.content_hash,
         }
         self.knowledge = crud.create_knowledge(self.db, data)
         return self.knowledge
 
     def store_pages(self, knowledge_id: int, num_pages: int, image_urls: Optional[List[str]] = None):
-        pages = [
-            {"page_no": i, "image_url": (image_urls[i - 1] if image_urls and i - 1 < len(image_urls) else "")}
-            for i in range(1, num_pages + 1)
-        ]
-        crud.bulk_create_pages(self.db, knowledge_id, pages)
+        crud.create_knowledge_pages(self.db, knowledge_id, num_pages, image_urls)
 
     def chunk_text(self, text: str) -> List[str]:
-        splitter = RecursiveCharacterTextSplitter(
-            chunk_size=800,
-            chunk_overlap=200,
-            length_function=_tok_len,
-            separators=["\n\n", "\n", " ", ""],
-        )
-        return splitter.split_text(text)
+        return _splitter(800, 200).split_text(text)
 
     def chunk_parent_child(self, text: str, *, default_title: str = "문서") -> List[Tuple[str, str]]:
-        raw_lines = (text or "").splitlines()
-        lines = [_norm_line(ln) for ln in raw_lines]
-        lines = [ln for ln in lines if ln]
+        lines = [n for n in map(_norm_line, (text or "").splitlines()) if n]
 
         if not lines:
             return []
@@ -363,7 +702,7 @@ class UploadPipeline:
         cur_body: List[str] = []
 
         for ln in lines:
-            if _is_heading(ln):
+            if _is_heading_normed(ln):
                 if cur_body:
                     sections.append((cur_title, "\n".join(cur_body).strip()))
                 t = ln.lstrip("#").strip()
@@ -378,45 +717,38 @@ class UploadPipeline:
         if not sections:
             sections = [(default_title or "문서", "\n".join(lines).strip())]
 
-        splitter = RecursiveCharacterTextSplitter(
-            chunk_size=_CHILD_CHUNK_SIZE,
-            chunk_overlap=_CHILD_CHUNK_OVERLAP,
-            length_function=_tok_len,
-            separators=["\n\n", "\n", " ", ""],
-        )
+        sections = [(title, body) for title, body in sections if body and body.strip()]
+        children_per_section = _split_child_bodies_parallel([body for _, body in sections])
 
         pairs: List[Tuple[str, str]] = []
-        for title, body in sections:
+        dropped = 0
+        for (title, body), child_chunks in zip(sections, children_per_section):
             title = _norm_line(title) or (default_title or "문서")
             summary = _make_parent_summary(body, _PARENT_SUMMARY_MAX_CHARS)
 
-            if not (body and body.strip()):
-                continue
+            # 섹션 단위로 한 번만 만드는 접두부(자식 청크마다 f-string/별칭 조회 반복 안 함)
+            store_prefix = f"{_PARENT_PREFIX}\n{title}\n{summary}\n\n{_CHILD_PREFIX}\n"
+            embed_prefix = ""
+            if _EMBED_INCLUDE_PARENT_TITLE:
+                aliases = _aliases_for_title(title) if _EMBED_INCLUDE_ALIASES else []
+                embed_prefix = f"{title}\n{' / '.join(aliases)}\n" if aliases else f"{title}\n"
 
-            child_chunks = splitter.split_text(body)
             for child in child_chunks:
                 c = (child or "").strip()
                 if not c:
                     continue
+                if not _is_embeddable(c):
+                    dropped += 1
+                    continue
 
-                store_text = (
-                    f"{_PARENT_PREFIX}\n"
-                    f"{title}\n"
-                    f"{summary}\n\n"
-                    f"{_CHILD_PREFIX}\n"
-                    f"{c}"
-                ).strip()
-
-                embed_text = c
-                if _EMBED_INCLUDE_PARENT_TITLE:
-                    aliases = _aliases_for_title(title) if _EMBED_INCLUDE_ALIASES else []
-                    if aliases:
-                        embed_text = f"{title}\n{' / '.join(aliases)}\n{c}"
-                    else:
-                        embed_text = f"{title}\n{c}"
+                store_text = store_prefix + c
+                embed_text = embed_prefix + c
 
                 pairs.append((store_text, embed_text))
 
+        if dropped:
+            log.info("chunk_parent_child: dropped %d non-embeddable chunks", dropped)
+
         if DEBUG_RAG_URL:
             try:
                 sample = "\n\n".join(p[0] for p in pairs[:8])
@@ -426,23 +758,21 @@ class UploadPipeline:
 
         return pairs
 
-    def embed_chunks(self, chunks: List[str]) -> Tuple[List[str], List[List[float]]]:
-        cleaned = [c for c in chunks if c and c.strip()]
-        if not cleaned:
-            return [], []
+    def embed_chunks(self, chunks: List[str]) -> Tuple[List[str], List[np.ndarray]]:
+        cleaned, vecs, _ = self._embed_chunks(chunks)
+        return cleaned, vecs
 
-        if _HAS_BATCH:
-            vecs = text_list_to_vectors(cleaned)  # type: ignore
-        else:
-            vecs: List[List[float]] = []
-            max_workers = min(4, (os.cpu_count() or 4))
-            with ThreadPoolExecutor(max_workers=max_workers) as ex:
-                for v in ex.map(text_to_vector, cleaned):
-                    vecs.append(v)
+    def _embed_chunks(self, chunks: List[str]) -> Tuple[List[str], List[np.ndarray], int]:
+        cleaned = [c for c in chunks if c and _is_embeddable(c)]
+        if len(cleaned) < len(chunks):
+            log.info("embed_chunks: dropped %d non-embeddable chunks", len(chunks) - len(cleaned))
+        if not cleaned:
+            return [], [], 0
 
-        return cleaned, vecs
+        vecs, sent = _embed_texts_billed(cleaned)
+        return cleaned, vecs, tokens_for_texts(_TOK_MODEL, sent)
 
-    def embed_parent_child_pairs(self, pairs: List[Tuple[str, str]]) -> Tuple[List[str], List[List[float]], int]:
+    def embed_parent_child_pairs(self, pairs: List[Tuple[str, str]]) -> Tuple[List[str], List[np.ndarray], int]:
         cleaned_store: List[str] = []
         embed_inputs: List[str] = []
 
@@ -457,20 +787,24 @@ class UploadPipeline:
         if not embed_inputs:
             return [], [], 0
 
-        if _HAS_BATCH:
-            vecs = text_list_to_vectors(embed_inputs)  # type: ignore
-        else:
-            vecs: List[List[float]] = []
-            max_workers = min(4, (os.cpu_count() or 4))
-            with ThreadPoolExecutor(max_workers=max_workers) as ex:
-                for v in ex.map(text_to_vector, embed_inputs):
-                    vecs.append(v)
-
-        total_tokens = sum(_tok_len(et) for et in embed_inputs)
+        # 캐시 적중분은 API를 안 탔으므로 비용에서 제외
+        vecs, sent = _embed_texts_billed(embed_inputs)
+        total_tokens = tokens_for_texts(_TOK_MODEL, sent)
         return cleaned_store, vecs, total_tokens
 
-    def store_chunks(self, knowledge_id: int, chunks: List[str], vectors: List[List[float]]):
-        crud.create_knowledge_chunks(self.db, knowledge_id, chunks, vectors)
+    def chunk_and_embed(self, text: str, default_title: str) -> Tuple[List[str], List[np.ndarray], int]:
+        """
+        청크 분할 + 임베딩 (DB 접근 없음 → 메타/페이지 저장과 병렬 실행 가능)
+        반환: (저장할 청크 텍스트, 벡터, 비용 집계용 토큰 수)
+        """
+        if _USE_PARENT_CHILD_CHUNKING:
+            pairs = self.chunk_parent_child(text, default_title=default_title)
+            return self.embed_parent_child_pairs(pairs)
+
+        return self._embed_chunks(self.chunk_text(text))
+
+    def store_chunks(self, knowledge_id: int, chunks: List[str], vectors: List[np.ndarray], commit: bool = True):
+        crud.create_knowledge_chunks(self.db, knowledge_id, chunks, vectors, commit=commit)
 
     def _set_status(self, knowledge_id: int, status: str):
         try:
@@ -478,53 +812,95 @@ class UploadPipeline:
         except Exception:
             pass
 
+    def _clone_from(self, file: UploadFile, src: Knowledge) -> Knowledge:
+        know = self.create_metadata(file, src.preview)
+        n = crud.clone_knowledge_content(self.db, src.id, know.id, commit=False)
+        crud.update_knowledge(self.db, know.id, {"status": "active"})
+        qa_cache.clear()
+        log.info("upload dedup: knowledge=%s cloned %d chunks from knowledge=%s", know.id, n, src.id)
+        return know
+
     def run(self, file: UploadFile) -> Knowledge:
+        embed_future = None
+        cost_committed = False
         try:
             path = self.save_file(file)
+
+            # 같은 파일이 이미 처리돼 있으면 추출/청크/임베딩 없이 복사만
+            if _DEDUP_BY_HASH and self.content_hash:
+                src = crud.find_knowledge_by_hash(self.db, self.content_hash)
+                if src is not None:
+                    return self._clone_from(file, src)
+
             text, num_pages = self.extract_text(path)
 
+            # 청크 → 임베딩(외부 API)은 DB와 무관하므로 먼저 띄워두고, 그동안 메타/페이지 저장
+            embed_future = _EMBED_POOL.submit(self.chunk_and_embed, text, file.filename or "문서")
+
             preview = self._build_preview(text)
             know = self.create_metadata(file, preview)
             self.store_pages(know.id, num_pages)
 
-            total_tokens_for_cost = 0
+            # 청크 저장 + 비용 기록 + active 전환을 한 트랜잭션(커밋 1회)으로 묶음
+            store_texts, vectors, total_tokens_for_cost = embed_future.result()
+            if vectors:
+                self.store_chunks(know.id, store_texts, vectors, commit=False)
 
-            if _USE_PARENT_CHILD_CHUNKING:
-                pairs = self.chunk_parent_child(text, default_title=(file.filename or "문서"))
-                store_texts, vectors, total_tokens_for_cost = self.embed_parent_child_pairs(pairs)
-                if vectors:
-                    self.store_chunks(know.id, store_texts, vectors)
-            else:
-                chunks = self.chunk_text(text)
-                chunks, vectors = self.embed_chunks(chunks)
-                if vectors:
-                    self.store_chunks(know.id, chunks, vectors)
-                    total_tokens_for_cost = sum(_tok_len(c or "") for c in chunks)
-
-            if total_tokens_for_cost > 0:
-                try:
-                    usage = normalize_usage_embedding(total_tokens_for_cost)
-                    usd = estimate_embedding_cost_usd(
-                        model=getattr(config, "DEFAULT_EMBEDDING_MODEL", "text-embedding-3-small"),
-                        total_tokens=usage["embedding_tokens"],
-                    )
-                    cost.add_event(
-                        self.db,
-                        ts_utc=datetime.now(timezone.utc),
-                        product="embedding",
-                        model=getattr(config, "DEFAULT_EMBEDDING_MODEL", "text-embedding-3-small"),
-                        llm_tokens=0,
-                        embedding_tokens=usage["embedding_tokens"],
-                        audio_seconds=0,
-                        cost_usd=usd,
-                    )
-                except Exception as e:
-                    log.exception("api-cost embedding record failed: %s", e)
-
-            self._set_status(know.id, "active")
+            self._record_embedding_cost(total_tokens_for_cost, commit=False)
+
+            # 여기서 커밋 실패는 삼키지 않음(청크가 저장 안 됐는데 active로 보이면 안 됨) → except에서 error 처리
+            crud.update_knowledge(self.db, know.id, {"status": "active"})
+            cost_committed = True
+            # 새 문서가 검색 대상에 들어왔으므로 이전 QA 응답 캐시는 무효화
+            qa_cache.clear()
             return know
 
         except Exception:
+            self.db.rollback()
+            if embed_future is not None and not cost_committed:
+                self._drain_embedding(embed_future)
             if self.knowledge:
                 self._set_status(self.knowledge.id, "error")
             raise
+
+    def _drain_embedding(self, embed_future) -> None:
+        """
+        실패 경로: 아직 시작 전이면 취소, 이미 돌고 있으면(또는 끝났으면) 결과를 기다려
+        실제로 호출된 임베딩 비용은 별도 커밋으로 기록(본 트랜잭션은 롤백됨).
+        """
+        if embed_future.cancel():
+            return
+        try:
+            _, _, tokens = embed_future.result()
+        except Exception:
+            return
+        self._record_embedding_cost(tokens, commit=True)
+
+    def _record_embedding_cost(self, total_tokens: int, *, commit: bool) -> None:
+        if total_tokens <= 0:
+            return
+        try:
+            usage = normalize_usage_embedding(total_tokens)
+            usd = estimate_embedding_cost_usd(
+                model=getattr(config, "DEFAULT_EMBEDDING_MODEL", "text-embedding-3-small"),
+                total_tokens=usage["embedding_tokens"],
+            )
+            # savepoint: 비용 기록이 실패해도 청크 저장 트랜잭션은 살림
+            with self.db.begin_nested():
+                cost.add_event(
+                    self.db,
+                    ts_utc=datetime.now(timezone.utc),
+                    product="embedding",
+                    model=getattr(config, "DEFAULT_EMBEDDING_MODEL", "text-embedding-3-small"),
+                    llm_tokens=0,
+                    embedding_tokens=usage["embedding_tokens"],
+                    audio_seconds=0,
+                    cost_usd=usd,
+                    commit=False,
+                )
+            if commit:
+                self.db.commit()
+        except Exception as e:
+            if commit:
+                self.db.rollback()
+            log.exception("api-cost embedding record failed: %s", e)
@@ -1,8 +1,11 @@
 import os, io, wave
-import pyaudio
+from functools import lru_cache
+
 from dotenv import load_dotenv
 from openai import OpenAI
 
+from service.http_clients import openai_http_client
+
 # ─────────────────────────────
 # ① 환경 변수
 # ─────────────────────────────
@@ -14,23 +17,35 @@ DURATION = int(os.getenv("DURATION", "5"))
 if not API_KEY:
     raise ValueError("OPENAI_API_KEY가 필요합니다 ")
 
+# 호출마다 만들지 않고 모듈 단위로 재사용(공용 httpx 풀 → keep-alive/HTTP2 커넥션 유지)
+_CLIENT = OpenAI(api_key=API_KEY, http_client=openai_http_client)
+
 # ─────────────────────────────
 # ② 마이크 설정
 # ─────────────────────────────
-FORMAT = pyaudio.paInt16
 CHANNELS = 1
 RATE = 16000
 CHUNK = 1024
 
+
+@lru_cache(maxsize=1)
+def _pyaudio():
+    # PortAudio 바인딩은 실제로 녹음할 때만 로드(transcribe만 쓰는 경우 불필요)
+    import pyaudio
+
+    return pyaudio
+
+
 def record_audio_to_wav_bytes(seconds: int = 5) -> bytes:
     """마이크로 녹음 후 WAV 바이트 반환(16k/mono/16bit)"""
+    pyaudio = _pyaudio()
+    fmt = pyaudio.paInt16
     pa = pyaudio.PyAudio()
-    stream = pa.open(format=FORMAT, channels=CHANNELS, rate=RATE,
+    stream = pa.open(format=fmt, channels=CHANNELS, rate=RATE,
                      input=True, frames_per_buffer=CHUNK)
     print(f"🎙 녹음 시작... ({seconds}초)")
-    frames = []
-    for _ in range(int(RATE / CHUNK * seconds)):
-        frames.append(stream.read(CHUNK, exception_on_overflow=False))
+    # 전체 길이를 한 번에 요청 → PortAudio가 C 레벨에서 버퍼를 채움(파이썬 루프/청크별 bytes 생성 없음)
+    pcm = stream.read(int(RATE / CHUNK * seconds) * CHUNK, exception_on_overflow=False)
     print("✅ 녹음 완료")
 
     stream.stop_stream(); stream.close(); pa.terminate()
@@ -38,9 +53,9 @@ def record_audio_to_wav_bytes(seconds: int = 5) -> bytes:
     buf = io.BytesIO()
     wf = wave.open(buf, "wb")
     wf.setnchannels(CHANNELS)
-    wf.setsampwidth(pa.get_sample_size(FORMAT))
+    wf.setsampwidth(pa.get_sample_size(fmt))
     wf.setframerate(RATE)
-    wf.writeframes(b"".join(frames))
+    wf.writeframes(pcm)
     wf.close()
     return buf.getvalue()
 
@@ -48,14 +63,11 @@ def record_audio_to_wav_bytes(seconds: int = 5) -> bytes:
 # ③ Whisper API 호출
 # ─────────────────────────────
 def transcribe_with_whisper(wav_bytes: bytes, *, language: str = "ko") -> str:
-    client = OpenAI(api_key=API_KEY)
-    # file-like 객체로 전달
-    file_like = io.BytesIO(wav_bytes)
-    file_like.name = "audio.wav"  # 확장자 힌트
-    resp = client.audio.transcriptions.create(
+    # (파일명, bytes) 튜플로 바로 전달 → BytesIO 래핑/복사 없이 확장자 힌트만 제공
+    resp = _CLIENT.audio.transcriptions.create(
         # model="whisper-1", 
         model="large-v3-turbo",
-        file=file_like,
+        file=("audio.wav", wav_bytes),
         language=language,     # 언어 고정. 자동 감지 원하면 제거
         response_format="json" # 기본값
     )
@@ -3,31 +3,42 @@ from __future__ import annotations
 
 import asyncio
 import threading
-from dataclasses import dataclass
+from collections import deque
+from dataclasses import dataclass, field
 from datetime import datetime, timezone
-from typing import Any, Dict, Optional, Set
+from functools import lru_cache
+from typing import Any, Dict, Iterable, Optional, Set, Tuple
+
+import orjson
 
 
 def _utcnow() -> datetime:
     return datetime.now(timezone.utc)
 
 
-@dataclass
+def _encode(message: Dict[str, Any]) -> str:
+    # publish 1회당 한 번만 직렬화 → 모든 수신 연결이 같은 문자열을 공유(연결마다 json.dumps 하지 않음)
+    return orjson.dumps(message, option=orjson.OPT_NON_STR_KEYS).decode()
+
+
+@lru_cache(maxsize=4096)
+def _hello_payload(admin_id: int) -> str:
+    # 연결 직후 hello는 admin_id만 다르므로 admin별로 한 번만 직렬화
+    return _encode({"type": "hello", "admin_id": admin_id})
+
+
+@dataclass(slots=True, eq=False)
 class WSConn:
     """
-    set에 넣기 위해 해시/동등성은 객체 identity 기준으로 동작.
-    (asyncio.Queue는 기본적으로 unhashable이라 dataclass(frozen) + set 조합이 깨짐)
+    eq=False → 해시/동등성은 object 기본(identity) 그대로(연결 목록에서 자기 자신만 찾아 제거).
+    slots → 인스턴스 __dict__ 없음(연결당 메모리 절감, _enqueue의 속성 접근이 슬롯 조회)
     """
     admin_id: int
     ws: Any  # fastapi.WebSocket (순환 import 피하려고 Any)
-    send_q: "asyncio.Queue[dict[str, Any]]"
+    send_q: "deque[str]"  # 직렬화된 JSON 텍스트, maxlen 링버퍼(가득 차면 가장 오래된 것부터 밀려남)
     connected_at: datetime
-
-    def __hash__(self) -> int:  # identity hash
-        return id(self)
-
-    def __eq__(self, other: object) -> bool:
-        return self is other
+    data_event: asyncio.Event = field(default_factory=asyncio.Event)  # send_q에 보낼 게 생기면 set
+    dropped: int = 0  # 큐가 가득 차 밀려난(버려진) 메시지 수
 
 
 class WSManager:
@@ -38,14 +49,16 @@ class WSManager:
     - FastAPI의 sync endpoint(일반 def)는 threadpool에서 실행될 수 있음.
       그 안에서 publish하려면 publish_sync()로 event-loop에 안전하게 스케줄링해야 함.
     - websocket endpoint(async)에서는 publish()를 그냥 await로 써도 됨.
+    - 연결 목록은 copy-on-write: admin별 tuple을 통째로 교체하므로 publish는 락 없이 읽기만 함.
+      (변경은 이벤트 루프 스레드에서만, await 없이 일어나서 다른 코루틴이 중간 상태를 볼 수 없음)
     """
 
     def __init__(self, *, queue_maxsize: int = 200) -> None:
-        self._by_admin: dict[int, Set[WSConn]] = {}
-        self._lock = asyncio.Lock()
+        self._by_admin: dict[int, Tuple[WSConn, ...]] = {}
 
         self._queue_maxsize = int(queue_maxsize)
 
+        # 읽기는 락 없이 참조 한 번(참조 대입/읽기는 원자적), 락은 드문 쓰기(최초 저장 CAS)에만 사용
         self._loop: Optional[asyncio.AbstractEventLoop] = None
         self._loop_lock = threading.Lock()
 
@@ -58,6 +71,8 @@ class WSManager:
 
     def _ensure_loop(self) -> None:
         # websocket 연결이 최초로 생길 때 loop를 저장
+        if self._loop is not None:
+            return
         try:
             loop = asyncio.get_running_loop()
         except RuntimeError:
@@ -67,8 +82,7 @@ class WSManager:
                 self._loop = loop
 
     def has_loop(self) -> bool:
-        with self._loop_lock:
-            return self._loop is not None
+        return self._loop is not None
 
     # -------------------------
     # 연결 관리
@@ -82,52 +96,60 @@ class WSManager:
         conn = WSConn(
             admin_id=admin_id,
             ws=ws,
-            send_q=asyncio.Queue(maxsize=self._queue_maxsize),
+            send_q=deque(maxlen=self._queue_maxsize),
             connected_at=_utcnow(),
         )
 
-        async with self._lock:
-            self._by_admin.setdefault(admin_id, set()).add(conn)
+        self._by_admin[admin_id] = (*self._by_admin.get(admin_id, ()), conn)
 
         # 연결 직후 hello(선택)
-        self._enqueue(conn, {"type": "hello", "admin_id": admin_id})
+        self._enqueue(conn, _hello_payload(admin_id))
         return conn
 
     async def unregister(self, admin_id: int, conn: WSConn) -> None:
-        async with self._lock:
-            conns = self._by_admin.get(admin_id)
-            if not conns:
-                return
-            conns.discard(conn)
-            if not conns:
-                self._by_admin.pop(admin_id, None)
+        conns = self._by_admin.get(admin_id)
+        if not conns:
+            return
+        rest = tuple(c for c in conns if c is not conn)
+        if rest:
+            self._by_admin[admin_id] = rest
+        else:
+            self._by_admin.pop(admin_id, None)
 
     async def connected_count(self, admin_id: Optional[int] = None) -> int:
-        async with self._lock:
-            if admin_id is None:
-                return sum(len(v) for v in self._by_admin.values())
-            return len(self._by_admin.get(admin_id, set()))
+        if admin_id is None:
+            return sum(map(len, list(self._by_admin.values())))
+        return len(self._by_admin.get(admin_id, ()))
 
     async def connected_admin_ids(self) -> Set[int]:
-        async with self._lock:
-            return set(self._by_admin.keys())
+        return set(self._by_admin)
+
+    async def stats(self) -> Dict[str, int]:
+        """연결 수 + 느린 클라이언트로 인해 버려진 메시지 합계(현재 연결 기준)"""
+        conns = [c for v in list(self._by_admin.values()) for c in v]
+        return {"connections": len(conns), "dropped_total": sum(c.dropped for c in conns)}
 
     # -------------------------
     # publish (async)
     # -------------------------
     async def publish(self, admin_id: int, message: Dict[str, Any]) -> None:
-        async with self._lock:
-            conns = list(self._by_admin.get(admin_id, set()))
-        for conn in conns:
-            self._enqueue(conn, message)
+        conns = self._by_admin.get(admin_id, ())
+        if not conns:
+            return
+        self._publish_fast((admin_id,), _encode(message))
 
     async def publish_many(self, admin_ids: Set[int], message: Dict[str, Any]) -> None:
-        async with self._lock:
-            conns: list[WSConn] = []
-            for aid in admin_ids:
-                conns.extend(list(self._by_admin.get(aid, set())))
-        for conn in conns:
-            self._enqueue(conn, message)
+        by_admin = self._by_admin
+        payload: Optional[str] = None
+        for aid in admin_ids:
+            for conn in by_admin.get(aid, ()):
+                if payload is None:
+                    payload = _encode(message)
+                self._enqueue(conn, payload)
+
+    async def publish_all(self, message: Dict[str, Any]) -> None:
+        """연결된 모든 admin에게 전송(시스템 공지 등)"""
+        self._publish_all_fast(_encode(message))
 
     # -------------------------
     # publish (sync-safe)
@@ -135,48 +157,62 @@ class WSManager:
     def publish_sync(self, admin_id: int, message: Dict[str, Any]) -> bool:
         """
         sync endpoint(threadpool)에서 호출할 때 사용.
-        루프가 준비되어 있으면 run_coroutine_threadsafe로 스케줄링.
+        루프가 준비되어 있으면 호출 스레드에서 직렬화한 뒤 call_soon_threadsafe로 enqueue만 넘김
+        (코루틴/Task/concurrent Future 생성 없음).
 
         return:
           - True: 스케줄링 성공
-          - False: 루프가 아직 없어서 못 보냄(WS 연결이 한 번도 없었거나, 아직 loop 저장 전)
+          - False: 루프가 아직 없어서 못 보냄(앱 lifespan에서 set_loop 전이고 WS 연결도 한 번도 없었음)
         """
-        with self._loop_lock:
-            loop = self._loop
+        loop = self._loop
 
         if loop is None:
             return False
 
-        asyncio.run_coroutine_threadsafe(self.publish(admin_id, message), loop)
+        loop.call_soon_threadsafe(self._publish_fast, (admin_id,), _encode(message))
         return True
 
     def publish_many_sync(self, admin_ids: Set[int], message: Dict[str, Any]) -> bool:
-        with self._loop_lock:
-            loop = self._loop
+        loop = self._loop
+        if loop is None:
+            return False
+        # 호출 측이 set을 계속 바꿀 수 있으므로 여기서 고정
+        loop.call_soon_threadsafe(self._publish_fast, tuple(admin_ids), _encode(message))
+        return True
+
+    def publish_all_sync(self, message: Dict[str, Any]) -> bool:
+        loop = self._loop
         if loop is None:
             return False
-        asyncio.run_coroutine_threadsafe(self.publish_many(admin_ids, message), loop)
+        loop.call_soon_threadsafe(self._publish_all_fast, _encode(message))
         return True
 
     # -------------------------
     # internal queueing
     # -------------------------
-    def _enqueue(self, conn: WSConn, message: Dict[str, Any]) -> None:
+    def _publish_fast(self, admin_ids: Iterable[int], payload: str) -> None:
+        # 이벤트 루프 스레드에서만 호출(await 없음): 연결 tuple 스냅샷을 읽어 enqueue
+        by_admin = self._by_admin
+        for aid in admin_ids:
+            for conn in by_admin.get(aid, ()):
+                self._enqueue(conn, payload)
+
+    def _publish_all_fast(self, payload: str) -> None:
+        # admin_id 조회 없이 값(연결 tuple)만 순회, 별도 전체 인덱스는 두지 않음(register/unregister 비용 유지)
+        for conns in self._by_admin.values():
+            for conn in conns:
+                self._enqueue(conn, payload)
+
+    def _enqueue(self, conn: WSConn, payload: str) -> None:
         """
         느린 클라이언트 보호:
-        - 큐가 꽉 차면 가장 오래된 1개 버리고 최신을 넣음
+        - 큐가 꽉 차면 가장 오래된 1개 버리고 최신을 넣음(deque maxlen이 C 레벨에서 처리, Future 생성 없음)
         """
         q = conn.send_q
-        if q.full():
-            try:
-                q.get_nowait()
-            except Exception:
-                pass
-        try:
-            q.put_nowait(message)
-        except Exception:
-            # 그래도 실패하면 드랍
-            return
+        if len(q) == q.maxlen:
+            conn.dropped += 1
+        q.append(payload)
+        conn.data_event.set()
 
 
 # 전역 싱글톤